@@ -0,0 +1,190 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+from backend.metrics import incr
+
+# Configuration
+CACHE_PATH = Path("temp")/"cache"/"results.sqlite"
+DEFAULT_MAX_ENTRIES = 200000
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600  # seconds
+EVICT_EVERY = 500  # writes between eviction passes
+
+def make_key(sequence, tool, version, **config):
+    """Content-addressed key for a (sequence, tool version, config) triple"""
+    payload = json.dumps(
+        {"sequence": sequence, "tool": tool, "version": str(version), "config": config},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def file_digest(path):
+    """Hash a config file so edits invalidate cached results"""
+    path = Path(path)
+    if not path.exists():
+        return "missing"
+    return hashlib.sha256(path.read_bytes()).hexdigest()[:16]
+
+class ResultCache:
+    """Persistent SQLite store for folding and SimRNA results"""
+
+    def __init__(self, path=CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results(accessed)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Look up many keys in one round trip; returns {key: value} for hits"""
+        keys = list(keys)
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, value, created FROM results WHERE key IN ({marks})", batch
+                ).fetchall()
+                for key, value, created in rows:
+                    if self.max_age and now - created > self.max_age:
+                        continue
+                    found[key] = json.loads(value)
+            if found:
+                conn.executemany(
+                    "UPDATE results SET accessed = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                conn.commit()
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        incr("result_cache", len(found), result="hit")
+        incr("result_cache", len(keys) - len(found), result="miss")
+        return found
+
+    def put(self, key, value, extra_bytes=0):
+        """Store a JSON-serializable value"""
+        self.put_many([(key, value, extra_bytes)])
+
+    def put_many(self, items):
+        """Store many (key, value[, extra_bytes]) entries in one transaction
+
+        extra_bytes accounts for artifacts the entry points at (e.g. a PDB
+        model) so size-based eviction reflects real disk usage.
+        """
+        now = time.time()
+        rows = []
+        for item in items:
+            key, value = item[0], item[1]
+            extra_bytes = item[2] if len(item) > 2 else 0
+            payload = json.dumps(value)
+            rows.append((key, payload, len(payload) + extra_bytes, now, now))
+        if not rows:
+            return
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO results (key, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            conn.commit()
+        with self._lock:
+            self._writes += len(rows)
+            due = self._writes >= EVICT_EVERY
+            if due:
+                self._writes = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones over the limits"""
+        removed = 0
+        with closing(self._connect()) as conn:
+            if self.max_age:
+                cur = conn.execute(
+                    "DELETE FROM results WHERE created < ?", (time.time() - self.max_age,)
+                )
+                removed += cur.rowcount
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+            if (self.max_entries and count > self.max_entries) or \
+                    (self.max_bytes and total > self.max_bytes):
+                rows = conn.execute(
+                    "SELECT key, size FROM results ORDER BY accessed ASC"
+                ).fetchall()
+                doomed = []
+                for key, size in rows:
+                    over_count = self.max_entries and count > self.max_entries
+                    over_bytes = self.max_bytes and total > self.max_bytes
+                    if not (over_count or over_bytes):
+                        break
+                    doomed.append((key,))
+                    count -= 1
+                    total -= size
+                conn.executemany("DELETE FROM results WHERE key = ?", doomed)
+                removed += len(doomed)
+            conn.commit()
+        return removed
+
+    def stats(self):
+        """Hits and misses of this process, plus the cache's size on disk"""
+        with closing(self._connect()) as conn:
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total
+        }
+
+_cache = None
+
+def get_cache():
+    """Process-wide cache instance, created on first use"""
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
@@ -1,51 +1,353 @@
-import subprocess
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import os
+import hashlib
+import json
+import shutil
+import tempfile
+import atexit
+import importlib.util
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from backend.metrics import span, incr, run_tool
 
-def run_docking_analysis(df, target_pdb):
-    # Create temp directory if it doesn't exist
-    Path("temp").mkdir(exist_ok=True)
-    
-    # Convert target to PDBQT
-    target_pdbqt = Path(target_pdb).with_suffix(".pdbqt")
-    
+# Configuration
+TEMP_DIR = Path("temp")
+RECEPTOR_DIR = TEMP_DIR/"receptors"
+BOX_PADDING = 8.0  # Angstrom added around the receptor on every side
+
+# Vina search effort: higher exhaustiveness is slower but more thorough;
+# max_evals (0 = Vina's heuristic) caps the evaluations per Monte Carlo run
+DEFAULT_EXHAUSTIVENESS = 8
+DEFAULT_MAX_EVALS = 0
+MAX_POOLS = 2  # warm docking pools kept per process, least recently used closed first
+
+def receptor_hash(target_pdb):
+    """Content hash of a receptor PDB, independent of its file name"""
+    return hashlib.sha256(Path(target_pdb).read_bytes()).hexdigest()[:16]
+
+def compute_box(target_pdb, padding=BOX_PADDING):
+    """Docking grid box enclosing every atom of the receptor"""
+    coords = []
+    with open(target_pdb) as f:
+        for line in f:
+            if line.startswith(("ATOM", "HETATM")):
+                try:
+                    coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+                except ValueError:
+                    continue
+    if not coords:
+        raise ValueError(f"No atom coordinates found in {target_pdb}")
+    lows = [min(c[i] for c in coords) for i in range(3)]
+    highs = [max(c[i] for c in coords) for i in range(3)]
+    return {
+        "center": [round((lo + hi) / 2, 3) for lo, hi in zip(lows, highs)],
+        "size": [round(hi - lo + 2 * padding, 3) for lo, hi in zip(lows, highs)]
+    }
+
+def prepare_receptor(target_pdb):
+    """Prepare a receptor once per unique PDB content and reuse it afterwards
+
+    Returns {"hash", "pdbqt", "box"}. Preparation happens in a private
+    directory that is renamed into place, so concurrent runs against the
+    same target never observe a half-written receptor.
+    """
+    digest = receptor_hash(target_pdb)
+    final_dir = RECEPTOR_DIR/digest
+    pdbqt = final_dir/"receptor.pdbqt"
+    box_file = final_dir/"box.json"
+
+    if not (pdbqt.exists() and box_file.exists()):
+        RECEPTOR_DIR.mkdir(exist_ok=True, parents=True)
+        work_dir = Path(tempfile.mkdtemp(prefix=f".{digest}-", dir=RECEPTOR_DIR))
+        os.chmod(work_dir, 0o755)  # mkdtemp is owner-only; receptors are shared
+        try:
+            # Prepare receptor with Meeko
+            incr("receptor_cache", result="miss")
+            run_tool([
+                "mk_prepare_receptor.py",
+                "--read_pdb", str(target_pdb),  # Use --read_pdb instead of -i
+                "-o", str(work_dir/"receptor"),  # Meeko appends .pdbqt
+                "-p",  # Generate PDBQT files
+                "--allow_bad_res"  # Handle partially resolved residues
+            ], "mk_prepare_receptor", check=True, capture_output=True, text=True)
+            (work_dir/"box.json").write_text(json.dumps(compute_box(target_pdb)))
+            try:
+                os.rename(work_dir, final_dir)
+            except OSError:
+                # Another run finished first; keep its copy
+                shutil.rmtree(work_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+    else:
+        incr("receptor_cache", result="hit")
+
+    return {
+        "hash": digest,
+        "pdbqt": str(pdbqt),
+        "box": json.loads(box_file.read_text())
+    }
+
+def simulated_affinity(seq):
+    """GC-based placeholder affinity used when real docking is unavailable"""
+    gc_content = (seq.count('G') + seq.count('C')) / len(seq) if seq else 0.0
+    return -8.5 + (gc_content * 2.0)
+
+def vina_available():
+    return importlib.util.find_spec("vina") is not None and shutil.which("obabel") is not None
+
+def prepare_ligand(model_path):
+    """Convert a 3D aptamer model to a rigid Vina ligand PDBQT next to it"""
+    model_path = Path(model_path)
+    ligand = model_path.with_suffix(".pdbqt")
+    if ligand.exists() and ligand.stat().st_mtime >= model_path.stat().st_mtime:
+        return ligand
+    converted = run_tool(
+        ["obabel", "-ipdb", str(model_path), "-opdbqt", "-xr"], "obabel",
+        check=True, capture_output=True, text=True
+    ).stdout
+    atoms = [line for line in converted.splitlines() if line.startswith(("ATOM", "HETATM"))]
+    if not atoms:
+        raise ValueError(f"No atoms converted from {model_path}")
+    # Aptamers have far more torsions than Vina can search, so dock them rigid
+    tmp = ligand.with_suffix(f".tmp{os.getpid()}")
+    tmp.write_text("ROOT\n" + "\n".join(atoms) + "\nENDROOT\nTORSDOF 0\n")
+    os.replace(tmp, ligand)
+    return ligand
+
+# Per-process docking state, set once by _init_docking_worker
+_worker = {}
+
+def _init_docking_worker(receptors, exhaustiveness, max_evals):
+    """Load every receptor and compute its affinity maps once per worker process"""
+    from vina import Vina
+    _worker.update(vina={}, exhaustiveness=exhaustiveness, max_evals=max_evals)
+    for receptor in receptors:
+        v = Vina(sf_name="vina", cpu=1, verbosity=0)
+        v.set_receptor(receptor["pdbqt"])
+        v.compute_vina_maps(center=receptor["box"]["center"], box_size=receptor["box"]["size"])
+        _worker["vina"][receptor["hash"]] = v
+
+def _dock_model(task):
+    """Dock one (receptor hash, model path) pair; None on failure"""
+    digest, model_path = task
     try:
-        # Check if target PDB file exists
-        if not Path(target_pdb).exists():
-            print(f"Target PDB file {target_pdb} does not exist.")
-            # Return dummy data to prevent pipeline failure
-            return pd.DataFrame({
-                "sequence": df['sequence'],
-                "affinity": [-7.5] * len(df)
-            })
-        
-        # Prepare receptor with Meeko
-        subprocess.run([
-            "mk_prepare_receptor.py",
-            "--read_pdb", str(target_pdb),  # Use --read_pdb instead of -i
-            "-o", str(target_pdbqt).replace(".pdbqt", ""),  # Remove .pdbqt extension
-            "-p",  # Generate PDBQT files
-            "--allow_bad_res"  # Handle partially resolved residues
-        ], check=True, capture_output=True, text=True)
-        
+        v = _worker["vina"][digest]
+        v.set_ligand_from_file(str(prepare_ligand(model_path)))
+        v.dock(exhaustiveness=_worker["exhaustiveness"], n_poses=1,
+               max_evals=_worker["max_evals"])
+        return float(v.energies(n_poses=1)[0][0])
     except Exception as e:
-        print(f"Error in receptor preparation: {str(e)}")
-        # Return dummy data to prevent pipeline failure
-        return pd.DataFrame({
-            "sequence": df['sequence'],
-            "affinity": [-7.5] * len(df)
-        })
-    
-    results = []
-    for seq in df["sequence"]:
-        # For now, simulate docking since we don't have rna_denovo
-        # In a real implementation, we would generate 3D structures and run Vina
-        
-        # Calculate a simulated affinity based on sequence properties
-        gc_content = (seq.count('G') + seq.count('C')) / len(seq)
-        simulated_affinity = -8.5 + (gc_content * 2.0)
-        
-        results.append({"sequence": seq, "affinity": simulated_affinity})
-    
-    return pd.DataFrame(results)
+        print(f"Docking failed for {model_path}: {str(e)}")
+        return None
+
+class DockingPool:
+    """Process pool whose workers each hold the Vina maps of one or more receptors"""
+
+    def __init__(self, receptors, exhaustiveness=DEFAULT_EXHAUSTIVENESS,
+                 max_evals=DEFAULT_MAX_EVALS, workers=None):
+        self.receptors = receptors
+        self.workers = workers or os.cpu_count() or 1
+        self.users = 0  # runs currently docking with this pool, guarded by _pools_lock
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_docking_worker,
+            initargs=(receptors, exhaustiveness, max_evals)
+        )
+
+    def dock_matrix(self, model_paths):
+        """(models x receptors) affinities; None where docking failed
+
+        All pairs go through the pool as one batch, model-major, so a
+        model's ligand is usually prepared once and reused for every target.
+        """
+        model_paths = list(model_paths)
+        tasks = [(r["hash"], path) for path in model_paths for r in self.receptors]
+        chunksize = max(1, len(tasks) // (self.workers * 4))
+        docked = list(self._executor.map(_dock_model, tasks, chunksize=chunksize))
+        width = len(self.receptors)
+        return [docked[i * width:(i + 1) * width] for i in range(len(model_paths))]
+
+    def dock(self, model_paths):
+        """Affinities against the first receptor in input order; None where docking failed"""
+        return [row[0] for row in self.dock_matrix(model_paths)]
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+_pools = OrderedDict()
+_pools_lock = threading.Lock()
+
+@contextmanager
+def docking_pool(receptors, exhaustiveness=DEFAULT_EXHAUSTIVENESS,
+                 max_evals=DEFAULT_MAX_EVALS, workers=None):
+    """Borrow the warm pool for a receptor set and search setting
+
+    At most MAX_POOLS pools stay warm between runs. Beyond that the least
+    recently used one is dropped and closed once no run is using it. A
+    pool whose run raised is dropped the same way, so the next run starts
+    a fresh one while other pools are left alone.
+    """
+    if isinstance(receptors, dict):
+        receptors = [receptors]
+    key = (tuple(r["hash"] for r in receptors), exhaustiveness, max_evals, workers)
+    with _pools_lock:
+        pool = _pools.pop(key, None) or DockingPool(receptors, exhaustiveness, max_evals, workers)
+        _pools[key] = pool  # most recently used last
+        pool.users += 1
+        idle = []
+        while len(_pools) > MAX_POOLS:
+            _, evicted = _pools.popitem(last=False)
+            if evicted.users == 0:
+                idle.append(evicted)
+    for evicted in idle:
+        evicted.close()
+
+    failed = False
+    try:
+        yield pool
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        with _pools_lock:
+            pool.users -= 1
+            if failed and _pools.get(key) is pool:
+                del _pools[key]
+            # Pools no longer cached are closed by their last user
+            close = pool.users == 0 and _pools.get(key) is not pool
+        if close:
+            pool.close()
+
+@atexit.register
+def close_pools():
+    """Close every cached docking pool, e.g. before a forked process exits"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+def target_names(target_pdbs):
+    """Column-friendly name per target: the file stem, made unique"""
+    names = []
+    for target in target_pdbs:
+        stem = Path(target).stem
+        name, n = stem, 2
+        while name in names:
+            name, n = f"{stem}_{n}", n + 1
+        names.append(name)
+    return names
+
+def selectivity_scores(affinities, docked=None):
+    """Per-target selectivity from an (n, targets) affinity array
+
+    Selectivity for a target is the best (lowest) affinity among the other
+    targets minus the affinity for this one, so positive values mean the
+    candidate binds this target more strongly than any off-target. With
+    docked (a matching bool array), only docked affinities count: the
+    selectivity is NaN when the target itself or every off-target was not
+    docked.
+    """
+    affinities = np.asarray(affinities, dtype=np.float64)
+    if docked is not None:
+        affinities = np.where(np.asarray(docked, dtype=bool), affinities, np.nan)
+    scores = np.full(affinities.shape, np.nan)
+    if affinities.shape[1] < 2:
+        return scores
+    for t in range(affinities.shape[1]):
+        # fmin skips NaN, so only all-undocked off-targets give NaN
+        best_off = np.fmin.reduce(np.delete(affinities, t, axis=1), axis=1)
+        scores[:, t] = best_off - affinities[:, t]
+    return scores
+
+def run_docking_matrix(df, target_pdbs, exhaustiveness=DEFAULT_EXHAUSTIVENESS,
+                       max_evals=DEFAULT_MAX_EVALS, workers=None):
+    """Dock candidates against every target and return a wide affinity table
+
+    Returns sequence plus affinity_<name> and docked_<name> columns per
+    target (names from target_names). Each receptor is prepared once and
+    all candidate x target pairs share one docking pool. Candidates with a
+    simulated 3D model (model_path, with its simrna_energy) are docked with
+    AutoDock Vina when it is installed; the rest, including the dummy models
+    written when SimRNA fails, get a simulated affinity. A target that is
+    missing or fails preparation gets placeholder affinities. docked_<name>
+    is true only where Vina produced the affinity, so placeholders are
+    never mistaken for measurements.
+    """
+    target_pdbs = list(target_pdbs)
+    names = target_names(target_pdbs)
+    sequences = df["sequence"].tolist()
+    simulated = [simulated_affinity(seq) for seq in sequences]
+    affinities = {name: list(simulated) for name in names}
+    docked_rows = {name: [False] * len(df) for name in names}
+
+    receptors = []
+    usable = []
+    for name, target_pdb in zip(names, target_pdbs):
+        try:
+            # Check if target PDB file exists
+            if not Path(target_pdb).exists():
+                print(f"Target PDB file {target_pdb} does not exist.")
+                # Dummy data prevents pipeline failure
+                affinities[name] = [-7.5] * len(df)
+                continue
+            receptors.append(prepare_receptor(target_pdb))
+            usable.append(name)
+        except Exception as e:
+            print(f"Error in receptor preparation: {str(e)}")
+            affinities[name] = [-7.5] * len(df)
+
+    model_paths = df["model_path"].tolist() if "model_path" in df.columns else []
+    # Only models from a finished simulation carry an energy; a dummy helix
+    # would dock to a plausible-looking but meaningless affinity
+    energies = df["simrna_energy"].tolist() if "simrna_energy" in df.columns else []
+    dockable = [
+        i for i, (path, energy) in enumerate(zip(model_paths, energies))
+        if isinstance(path, str) and pd.notna(energy) and Path(path).exists()
+    ]
+    if receptors and dockable and not vina_available():
+        print("AutoDock Vina or Open Babel not installed; using simulated affinities")
+    elif receptors and dockable:
+        try:
+            with docking_pool(receptors, exhaustiveness, max_evals, workers) as pool, \
+                    span("vina_dock"):
+                docked = pool.dock_matrix(model_paths[i] for i in dockable)
+            flat = [a for row in docked for a in row]
+            incr("vina_docked", sum(a is not None for a in flat))
+            incr("vina_failures", sum(a is None for a in flat))
+        except Exception as e:
+            # e.g. a worker died computing maps; docking_pool has dropped that
+            # pool, so the next run retries with a fresh one
+            print(f"Docking pool failed: {str(e)}")
+            docked = []
+        for i, row in zip(dockable, docked):
+            for name, affinity in zip(usable, row):
+                if affinity is not None:
+                    affinities[name][i] = affinity
+                    docked_rows[name][i] = True
+
+    return pd.DataFrame({
+        "sequence": sequences,
+        **{f"affinity_{name}": affinities[name] for name in names},
+        **{f"docked_{name}": docked_rows[name] for name in names}
+    })
+
+def run_docking_analysis(df, target_pdb, exhaustiveness=DEFAULT_EXHAUSTIVENESS,
+                         max_evals=DEFAULT_MAX_EVALS, workers=None):
+    """Dock candidates against target_pdb and return sequence/affinity/docked rows
+
+    Candidates with a simulated 3D model (model_path and simrna_energy) are
+    docked with AutoDock Vina when it is installed; the rest get a
+    simulated affinity, with docked set to False.
+    """
+    matrix = run_docking_matrix(df, [target_pdb], exhaustiveness, max_evals, workers)
+    return pd.DataFrame({
+        "sequence": matrix["sequence"],
+        "affinity": matrix.iloc[:, 1],
+        "docked": matrix.iloc[:, 2]
+    })
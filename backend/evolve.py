@@ -0,0 +1,157 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from backend.features import encode_sequences, decode_sequences
+from backend.structure import fold_sequences
+from backend.surrogate import get_surrogate
+from backend.metrics import span, incr
+
+# Configuration
+DEFAULT_POPULATION = 200
+DEFAULT_GENERATIONS = 20
+DEFAULT_MUTATION_RATE = 0.03  # per base
+DEFAULT_CROSSOVER_RATE = 0.7
+DEFAULT_ELITE = 0.1  # fraction of each generation carried over unchanged
+DEFAULT_TOURNAMENT = 3
+DEFAULT_PATIENCE = 5  # generations without improvement before stopping
+DEFAULT_TOLERANCE = 1e-4
+
+class Evolution:
+    """In-silico SELEX: evolve a population against the surrogate score
+
+    Each generation is bred from the previous one by tournament selection,
+    one-point crossover and point mutation on uint8-coded sequences, then
+    scored in one batched fold plus one batched surrogate call. Fitness is
+    memoized per sequence, so a sequence that reappears in a later
+    generation is never folded or scored again. Higher scores are better,
+    as in optimize_candidates. surrogate is the model that ranked the
+    starting population (see score_store); without one, the persisted model
+    for target (a receptor hash) is used. fold_options must be the ones the
+    population was folded with, so new sequences get the surrogate's extras.
+    """
+
+    def __init__(self, length, population_size=DEFAULT_POPULATION,
+                 mutation_rate=DEFAULT_MUTATION_RATE, crossover_rate=DEFAULT_CROSSOVER_RATE,
+                 elite=DEFAULT_ELITE, tournament=DEFAULT_TOURNAMENT, seed=None, workers=None,
+                 surrogate=None, fold_options=None, target=None):
+        self.length = length
+        self.population_size = population_size
+        self.mutation_rate = mutation_rate
+        self.crossover_rate = crossover_rate
+        self.elite = elite
+        self.tournament = tournament
+        self.workers = workers
+        self.rng = np.random.default_rng(seed)
+        self.surrogate = surrogate or get_surrogate(length, target=target)
+        self.fold_options = fold_options or {}
+        self.history = []
+        self._fitness = {}
+        self._folds = {}
+
+    @property
+    def evaluations(self):
+        """Distinct sequences folded and scored so far"""
+        return len(self._fitness)
+
+    def evaluate(self, sequences):
+        """Fitness for every sequence, folding and scoring only unseen ones"""
+        misses = [seq for seq in dict.fromkeys(sequences) if seq not in self._fitness]
+        if misses:
+            with span("evolve_evaluate"):
+                folded = fold_sequences(misses, workers=self.workers, **self.fold_options)
+                structures = [r["structure"] if r else "" for r in folded]
+                extras = {
+                    name: np.array([r.get(name, np.nan) if r else np.nan for r in folded])
+                    for name in self.surrogate.extras
+                }
+                scores = self.surrogate.predict(misses, structures, extras or None,
+                                                n_jobs=self.workers)
+            for seq, result, score in zip(misses, folded, scores):
+                self._folds[seq] = result
+                self._fitness[seq] = float(score)
+            incr("evolve_evaluations", len(misses))
+        return np.array([self._fitness[seq] for seq in sequences]), len(misses)
+
+    def _select(self, fitness, count):
+        contenders = self.rng.integers(0, len(fitness), size=(count, self.tournament))
+        winners = fitness[contenders].argmax(axis=1)
+        return contenders[np.arange(count), winners]
+
+    def breed(self, codes, fitness):
+        """Next generation: elites unchanged, the rest from crossover and mutation"""
+        n_elite = min(len(codes), max(1, int(round(self.elite * self.population_size))))
+        elites = codes[np.argsort(-fitness)[:n_elite]]
+        count = self.population_size - n_elite
+
+        parents_a = codes[self._select(fitness, count)]
+        parents_b = codes[self._select(fitness, count)]
+        cuts = self.rng.integers(1, self.length, size=count) if self.length > 1 \
+            else np.zeros(count, dtype=np.int64)
+        crossed = self.rng.random(count) < self.crossover_rate
+        take_a = (np.arange(self.length)[None, :] < cuts[:, None]) | ~crossed[:, None]
+        children = np.where(take_a, parents_a, parents_b)
+
+        # Shifting by 1-3 guarantees a mutated position really changes base
+        mutate = self.rng.random(children.shape) < self.mutation_rate
+        shift = self.rng.integers(1, 4, size=children.shape, dtype=np.uint8)
+        children = np.where(mutate, (children + shift) % 4, children).astype(np.uint8)
+        return np.concatenate([elites, children])
+
+    def run(self, population, generations=DEFAULT_GENERATIONS, patience=DEFAULT_PATIENCE,
+            tolerance=DEFAULT_TOLERANCE, on_generation=None):
+        """Evolve population and return the final generation, best first
+
+        on_generation(stats), if given, is called after every generation
+        with the same dict that is appended to self.history.
+        """
+        if not self.surrogate.is_trained:
+            raise ValueError("Surrogate model has not been trained")
+        codes = encode_sequences(population, self.length)
+        best = -np.inf
+        stale = 0
+        for generation in range(generations + 1):
+            start = time.perf_counter()
+            sequences = decode_sequences(codes)
+            fitness, evaluated = self.evaluate(sequences)
+            elapsed = time.perf_counter() - start
+
+            improvement = float(fitness.max() - best) if np.isfinite(best) else 0.0
+            best = max(best, float(fitness.max()))
+            stats = {
+                "generation": generation,
+                "best": best,
+                "mean": float(fitness.mean()),
+                "diversity": len(set(sequences)) / len(sequences),
+                "evaluated": evaluated,
+                "total_evaluations": self.evaluations,
+                "evals_per_sec": evaluated / elapsed if elapsed > 0 else 0.0,
+                "seconds": elapsed
+            }
+            self.history.append(stats)
+            if on_generation:
+                on_generation(stats)
+
+            stale = stale + 1 if generation and improvement <= tolerance else 0
+            if stale >= patience or generation == generations:
+                break
+            codes = self.breed(codes, fitness)
+        return self.to_frame(sequences)
+
+    def to_frame(self, sequences):
+        """Scored DataFrame for the given (already evaluated) sequences, best first"""
+        sequences = list(dict.fromkeys(sequences))
+        folded = [self._folds.get(seq) for seq in sequences]
+        frame = pd.DataFrame({
+            "sequence": sequences,
+            "structure": [r["structure"] if r else "" for r in folded],
+            "mfe": [r["mfe"] if r else 0.0 for r in folded],
+            "score": [self._fitness[seq] for seq in sequences]
+        })
+        return frame.sort_values("score", ascending=False, ignore_index=True)
+
+def format_generation(stats):
+    return (f"gen {stats['generation']:3d}  best {stats['best']:8.4f}  "
+            f"mean {stats['mean']:8.4f}  new {stats['evaluated']:6d}  "
+            f"{stats['evals_per_sec']:9.1f} evals/s")
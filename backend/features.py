@@ -0,0 +1,178 @@
+import numpy as np
+
+# Bump whenever the layout of build_feature_matrix changes so persisted
+# models trained on an older layout are not reused
+FEATURE_VERSION = 1
+
+BASES = "ACGT"
+SEQ_PAD = 4
+DOT, OPEN, CLOSE, STRUCT_PAD = 0, 1, 2, 3
+
+_SEQ_LUT = np.full(256, SEQ_PAD, dtype=np.uint8)
+for _code, _bases in enumerate(("Aa", "Cc", "Gg", "TtUu")):
+    for _b in _bases:
+        _SEQ_LUT[ord(_b)] = _code
+
+_STRUCT_LUT = np.full(256, STRUCT_PAD, dtype=np.uint8)
+_STRUCT_LUT[ord(".")] = DOT
+_STRUCT_LUT[ord("(")] = OPEN
+_STRUCT_LUT[ord(")")] = CLOSE
+
+def _encode(strings, lut, length):
+    strings = list(strings)
+    if length is None:
+        length = max((len(s) for s in strings), default=0)
+    if not strings or length == 0:
+        return np.zeros((len(strings), length), dtype=np.uint8)
+    # '\0' maps to the pad code in both lookup tables
+    buf = "".join(s[:length].ljust(length, "\0") for s in strings).encode("latin-1", "replace")
+    raw = np.frombuffer(buf, dtype=np.uint8).reshape(len(strings), length)
+    return lut[raw]
+
+def encode_sequences(sequences, length=None):
+    """Encode DNA/RNA strings as a (n, length) uint8 array (A=0 C=1 G=2 T/U=3, pad=4)"""
+    return _encode(sequences, _SEQ_LUT, length)
+
+def encode_structures(structures, length=None):
+    """Encode dot-bracket strings as a (n, length) uint8 array (.=0 (=1 )=2, pad=3)"""
+    return _encode(structures, _STRUCT_LUT, length)
+
+def decode_sequences(codes, alphabet=BASES):
+    """Inverse of encode_sequences; padding is dropped"""
+    table = np.frombuffer((alphabet + "\0").encode(), dtype=np.uint8)
+    raw = table[codes]
+    return [row.tobytes().rstrip(b"\0").decode() for row in raw]
+
+def decode_structures(codes):
+    """Inverse of encode_structures; padding is dropped"""
+    return decode_sequences(codes, alphabet=".()")
+
+def pack_codes(codes):
+    """Pack 2-bit codes (values 0-3) four to a byte: (n, length) -> (n, ceil(length / 4))"""
+    n, length = codes.shape
+    width = -(-length // 4)
+    padded = np.zeros((n, width * 4), dtype=np.uint8)
+    padded[:, :length] = codes
+    quads = padded.reshape(n, width, 4)
+    return quads[:, :, 0] | (quads[:, :, 1] << 2) | (quads[:, :, 2] << 4) | (quads[:, :, 3] << 6)
+
+def unpack_codes(packed, length):
+    """Inverse of pack_codes"""
+    shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+    codes = (packed[:, :, None] >> shifts) & 3
+    return codes.reshape(len(packed), -1)[:, :length]
+
+def gc_content(seq_codes):
+    valid = (seq_codes < SEQ_PAD).sum(axis=1)
+    gc = ((seq_codes == 1) | (seq_codes == 2)).sum(axis=1)
+    return np.divide(gc, valid, out=np.zeros(len(seq_codes)), where=valid > 0)
+
+def one_hot(seq_codes):
+    """Per-position one-hot, flattened to (n, length * 4); padding is all zeros"""
+    eye = np.eye(SEQ_PAD + 1, SEQ_PAD, dtype=np.float32)
+    return eye[seq_codes].reshape(len(seq_codes), -1)
+
+def kmer_counts(seq_codes, k=3):
+    """Count every k-mer per row as a (n, 4**k) array"""
+    n, length = seq_codes.shape
+    counts = np.zeros((n, 4 ** k), dtype=np.float32)
+    if length < k:
+        return counts
+    windows = np.lib.stride_tricks.sliding_window_view(seq_codes, k, axis=1)
+    valid = (windows < SEQ_PAD).all(axis=2)
+    index = np.zeros(windows.shape[:2], dtype=np.int64)
+    for j in range(k):
+        index = index * 4 + np.minimum(windows[:, :, j], 3)
+    rows = np.broadcast_to(np.arange(n)[:, None], index.shape)
+    flat = rows[valid] * 4 ** k + index[valid]
+    counts.ravel()[:] = np.bincount(flat, minlength=n * 4 ** k)
+    return counts
+
+def structure_features(struct_codes):
+    """Stem/loop counts and pairing-depth statistics per dot-bracket row
+
+    Returns an (n, 7) array: paired fraction, stems, hairpin loops,
+    unpaired runs, max depth, mean depth and paired-base count.
+    """
+    n, length = struct_codes.shape
+    if length == 0:
+        return np.zeros((n, 7), dtype=np.float32)
+    valid = struct_codes != STRUCT_PAD
+    opened = struct_codes == OPEN
+    closed = struct_codes == CLOSE
+    dots = struct_codes == DOT
+    n_valid = valid.sum(axis=1)
+    paired = opened.sum(axis=1) + closed.sum(axis=1)
+
+    prev = np.concatenate([np.full((n, 1), STRUCT_PAD, dtype=np.uint8), struct_codes[:, :-1]], axis=1)
+    stems = (opened & (prev != OPEN)).sum(axis=1)
+    unpaired_runs = (dots & (prev != DOT)).sum(axis=1)
+
+    # A hairpin closes where ')' follows '(' once unpaired bases are skipped:
+    # forward-fill the last bracket seen at each position
+    bracket = opened | closed
+    positions = np.where(bracket, np.arange(length), -1)
+    last = np.maximum.accumulate(positions, axis=1)
+    last_prev = np.concatenate([np.full((n, 1), -1), last[:, :-1]], axis=1)
+    last_code = np.take_along_axis(struct_codes, np.maximum(last_prev, 0), axis=1)
+    hairpins = (closed & (last_prev >= 0) & (last_code == OPEN)).sum(axis=1)
+
+    depth = np.cumsum(opened.astype(np.int16) - closed.astype(np.int16), axis=1)
+    max_depth = depth.max(axis=1)
+    mean_depth = np.divide((depth * valid).sum(axis=1), n_valid,
+                           out=np.zeros(n), where=n_valid > 0)
+    paired_fraction = np.divide(paired, n_valid, out=np.zeros(n), where=n_valid > 0)
+
+    return np.column_stack([
+        paired_fraction, stems, hairpins, unpaired_runs, max_depth, mean_depth, paired
+    ]).astype(np.float32)
+
+STRUCTURE_FEATURES = [
+    "paired_fraction", "stems", "hairpins", "unpaired_runs",
+    "max_depth", "mean_depth", "structure_complexity"
+]
+
+# Scalar folding outputs (see structure.FoldingEngine) that can be appended
+# to the feature matrix, in a fixed order
+FOLD_FEATURES = [
+    "ensemble_energy", "ensemble_defect", "mfe_probability",
+    "pairing_entropy", "subopt_gap", "subopt_count"
+]
+
+def feature_names(length, k=3, extras=()):
+    names = ["gc_content"] + STRUCTURE_FEATURES
+    names += [f"kmer_{''.join(BASES[(i // 4 ** (k - 1 - j)) % 4] for j in range(k))}"
+              for i in range(4 ** k)]
+    names += [f"pos{p}_{b}" for p in range(length) for b in BASES]
+    return names + list(extras)
+
+def build_feature_matrix(sequences, structures, length=None, k=3, extras=None):
+    """Vectorized feature matrix with a width that depends only on length and k
+
+    Returns (X, names) where X is float32 of shape (n, 8 + 4**k + 4 * length),
+    plus one column per entry of extras ({name: values}, e.g. ensemble
+    features from folding) when given.
+    """
+    sequences = list(sequences)
+    if length is None:
+        length = max((len(s) for s in sequences), default=0)
+    seq_codes = encode_sequences(sequences, length)
+    struct_codes = encode_structures(structures, length)
+    return build_feature_matrix_from_codes(seq_codes, struct_codes, k, extras)
+
+def build_feature_matrix_from_codes(seq_codes, struct_codes, k=3, extras=None):
+    """build_feature_matrix for sequences and structures that are already encoded"""
+    length = seq_codes.shape[1]
+    blocks = [
+        gc_content(seq_codes)[:, None].astype(np.float32),
+        structure_features(struct_codes),
+        kmer_counts(seq_codes, k),
+        one_hot(seq_codes)
+    ]
+    extras = extras or {}
+    if extras:
+        # Missing values (e.g. failed folds) become 0 so the model can use them
+        blocks.append(np.nan_to_num(np.column_stack([
+            np.asarray(values, dtype=np.float32) for values in extras.values()
+        ])))
+    return np.hstack(blocks), feature_names(length, k, extras)
@@ -1,5 +1,140 @@
-import random
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
-def generate_initial_candidates(num=20, length=20):
-    bases = ['A', 'T', 'C', 'G']
-    return [''.join(random.choices(bases, k=length)) for _ in range(num)]
+from backend.features import BASES, encode_sequences, decode_sequences
+from backend.metrics import incr
+
+# Configuration
+DEFAULT_GC_RANGE = (0.3, 0.7)
+DEFAULT_MAX_HOMOPOLYMER = 4
+DEFAULT_FORBIDDEN_MOTIFS = ()
+DEFAULT_MIN_STEM = 4  # Watson-Crick pairs needed for a plausible hairpin
+MIN_HAIRPIN_LOOP = 3
+MAX_ROUNDS = 50  # sampling rounds before giving up on strict filters
+HAIRPIN_BLOCK = 20000  # rows per pairwise stem comparison
+
+def has_homopolymer(codes, max_run):
+    """True for rows containing a run of more than max_run identical bases"""
+    if not max_run or codes.shape[1] <= max_run:
+        return np.zeros(len(codes), dtype=bool)
+    same = codes[:, 1:] == codes[:, :-1]
+    return sliding_window_view(same, max_run, axis=1).all(axis=2).any(axis=1)
+
+def has_motif(codes, motifs):
+    """True for rows containing any of the given motifs"""
+    found = np.zeros(len(codes), dtype=bool)
+    for motif in motifs:
+        pattern = encode_sequences([motif])[0]
+        if len(pattern) == 0 or len(pattern) > codes.shape[1]:
+            continue
+        windows = sliding_window_view(codes, len(pattern), axis=1)
+        found |= (windows == pattern).all(axis=2).any(axis=1)
+    return found
+
+def can_form_hairpin(codes, min_stem=DEFAULT_MIN_STEM, min_loop=MIN_HAIRPIN_LOOP):
+    """True for rows where some min_stem-mer pairs with a downstream reverse complement
+
+    A cheap stand-in for folding: a row without any such pair cannot form
+    a stem of that length, so folding it is wasted work.
+    """
+    n, length = codes.shape
+    if not min_stem or length < 2 * min_stem + min_loop:
+        return np.zeros(n, dtype=bool)
+    if n > HAIRPIN_BLOCK:
+        # The pairwise window comparison is quadratic in length; bound its memory
+        return np.concatenate([
+            can_form_hairpin(codes[i:i + HAIRPIN_BLOCK], min_stem, min_loop)
+            for i in range(0, n, HAIRPIN_BLOCK)
+        ])
+    weights = 4 ** np.arange(min_stem - 1, -1, -1)
+    windows = sliding_window_view(codes.astype(np.int64), min_stem, axis=1)
+    forward = windows @ weights
+    # A pairs with T (0 <-> 3) and C with G (1 <-> 2)
+    revcomp = (3 - windows[:, :, ::-1]) @ weights
+    offsets = np.arange(forward.shape[1])
+    allowed = offsets[None, :] >= offsets[:, None] + min_stem + min_loop
+    pairs = forward[:, :, None] == revcomp[:, None, :]
+    return (pairs & allowed).any(axis=(1, 2))
+
+class CandidateGenerator:
+    """Reproducible, deduplicated random aptamers with pre-folding filters
+
+    Sequences are drawn in vectorized batches as uint8 codes (A=0 C=1 G=2
+    T=3, as in backend.features) and rejected before folding when their GC
+    content is out of range, they contain long homopolymer runs or a
+    forbidden motif, or they cannot form even one hairpin stem. Every
+    sequence is emitted at most once per generator.
+    """
+
+    def __init__(self, length, seed=None, gc_range=DEFAULT_GC_RANGE,
+                 max_homopolymer=DEFAULT_MAX_HOMOPOLYMER,
+                 forbidden_motifs=DEFAULT_FORBIDDEN_MOTIFS, min_stem=DEFAULT_MIN_STEM):
+        self.length = length
+        self.rng = np.random.default_rng(seed)
+        self.gc_range = gc_range
+        self.max_homopolymer = max_homopolymer
+        self.forbidden_motifs = tuple(forbidden_motifs)
+        self.min_stem = min_stem
+        self._seen = set()
+        self._acceptance = 1.0
+
+    def _filter(self, codes):
+        keep = np.ones(len(codes), dtype=bool)
+        checks = []
+        if self.gc_range:
+            gc = ((codes == 1) | (codes == 2)).mean(axis=1)
+            checks.append(("gc", (gc < self.gc_range[0]) | (gc > self.gc_range[1])))
+        checks.append(("homopolymer", has_homopolymer(codes, self.max_homopolymer)))
+        if self.forbidden_motifs:
+            checks.append(("motif", has_motif(codes, self.forbidden_motifs)))
+        for reason, rejected in checks:
+            rejected &= keep
+            incr("generate_rejected", int(rejected.sum()), reason=reason)
+            keep &= ~rejected
+        if self.min_stem and self.length >= 2 * self.min_stem + MIN_HAIRPIN_LOOP:
+            # The pairwise stem check is the costliest, so run it on survivors only
+            survivors = np.flatnonzero(keep)
+            hairpin = can_form_hairpin(codes[survivors], self.min_stem)
+            incr("generate_rejected", int((~hairpin).sum()), reason="hairpin")
+            keep[survivors[~hairpin]] = False
+        return codes[keep]
+
+    def batch(self, num):
+        """Return up to num new sequences as an (n, length) uint8 array"""
+        accepted = []
+        needed = num
+        for _ in range(MAX_ROUNDS):
+            if needed <= 0:
+                break
+            # Oversample by the observed acceptance rate so one round usually suffices
+            draw = int(needed / max(self._acceptance, 0.01) * 1.2) + 16
+            codes = self.rng.integers(0, len(BASES), size=(draw, self.length), dtype=np.uint8)
+            passed = self._filter(codes)
+            fresh = []
+            duplicates = 0
+            for i, row in enumerate(passed):
+                key = row.tobytes()
+                if key in self._seen:
+                    duplicates += 1
+                    continue
+                self._seen.add(key)
+                fresh.append(i)
+                if len(fresh) == needed:
+                    break
+            incr("generate_rejected", duplicates, reason="duplicate")
+            self._acceptance = 0.5 * self._acceptance + 0.5 * max(len(passed) / draw, 1e-4)
+            accepted.append(passed[fresh])
+            needed -= len(fresh)
+        if needed > 0:
+            print(f"Candidate filters too strict: generated {num - needed} of {num}")
+        incr("generate_accepted", num - needed)
+        if not accepted:
+            return np.zeros((0, self.length), dtype=np.uint8)
+        return np.concatenate(accepted)
+
+    def sequences(self, num):
+        return decode_sequences(self.batch(num))
+
+def generate_initial_candidates(num=20, length=20, seed=None, **filters):
+    """Generate num unique, pre-filtered candidate sequences of the given length"""
+    return CandidateGenerator(length, seed=seed, **filters).sequences(num)
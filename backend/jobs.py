@@ -0,0 +1,374 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+import pandas as pd
+
+from backend.docking import DEFAULT_EXHAUSTIVENESS, receptor_hash, target_names
+
+# Configuration
+JOBS_DIR = Path("temp")/"jobs"
+JOBS_PATH = JOBS_DIR/"jobs.sqlite"
+CPU_BUDGET = os.cpu_count() or 1  # CPUs shared by all running jobs
+DEFAULT_JOB_CPUS = max(1, CPU_BUDGET // 2)
+DEFAULT_WORKERS = 2
+POLL_INTERVAL = 1.0  # seconds between claim attempts when idle
+HEARTBEAT_INTERVAL = 15.0
+STALE_AFTER = 120.0  # a running job without heartbeat for this long is requeued
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+class JobCancelled(Exception):
+    pass
+
+def job_id_for(params):
+    """Jobs with identical parameters (including the target hashes) share one ID"""
+    payload = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+class JobQueue:
+    """SQLite-backed queue running pipeline jobs on a local worker pool
+
+    Submissions are deduplicated by parameter hash: submitting a job that is
+    queued, running or done returns the existing one. Workers only start a
+    job while the CPUs of all running jobs fit in cpu_budget, and among
+    queued jobs they prefer owners with the fewest jobs running, so
+    concurrent users share capacity. Any number of processes may serve the
+    same queue file.
+    """
+
+    def __init__(self, path=JOBS_PATH, cpu_budget=CPU_BUDGET):
+        self.path = Path(path)
+        self.dir = self.path.parent
+        self.cpu_budget = cpu_budget
+        self._initialized = False
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _connect(self):
+        if not self._initialized:
+            self.dir.mkdir(exist_ok=True, parents=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    params TEXT NOT NULL,
+                    owner TEXT,
+                    cpus INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    error TEXT,
+                    submitted REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    heartbeat REAL,
+                    run TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, submitted)")
+            self._initialized = True
+        return conn
+
+    def job_dir(self, job_id):
+        return self.dir/job_id
+
+    def submit(self, params, target_pdb=None, owner=None, cpus=DEFAULT_JOB_CPUS):
+        """Queue a pipeline job, or return the ID of an identical one
+
+        params are run_job keyword arguments. target_pdb (one PDB or a list
+        for a multi-target screen, primary target first) is copied into the
+        job directory so the uploads may be removed afterwards.
+        """
+        params = dict(params)
+        targets = [] if target_pdb is None else \
+            [target_pdb] if isinstance(target_pdb, (str, Path)) else list(target_pdb)
+        if targets:
+            params["targets"] = target_names(targets)
+            params["target_hashes"] = [receptor_hash(target) for target in targets]
+        job_id = job_id_for(params)
+        cpus = max(1, min(cpus, self.cpu_budget))
+
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row and row["status"] in (QUEUED, RUNNING, DONE):
+                conn.execute("COMMIT")
+                return job_id
+            if targets:
+                target_dir = self.job_dir(job_id)/"targets"
+                target_dir.mkdir(exist_ok=True, parents=True)
+                for name, target in zip(params["targets"], targets):
+                    shutil.copy(target, target_dir/f"{name}.pdb")
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, params, owner, cpus, status, progress, "
+                "message, submitted) VALUES (?, ?, ?, ?, ?, 0, 'Queued', ?)",
+                (job_id, json.dumps(params), owner, cpus, QUEUED, time.time())
+            )
+            conn.execute("COMMIT")
+        return job_id
+
+    def get(self, job_id):
+        """Job row as a dict (params decoded), or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def list(self, limit=50):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, owner, cpus, status, progress, message, submitted "
+                "FROM jobs ORDER BY submitted DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def cancel(self, job_id):
+        """Cancel a queued job; a running one stops at its next checkpoint"""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, message = 'Cancelled', finished = ? "
+                "WHERE id = ? AND status IN (?, ?)",
+                (CANCELLED, time.time(), job_id, QUEUED, RUNNING)
+            )
+
+    def results(self, job_id):
+        """(scored DataFrame, summary) of a finished job
+
+        The summary holds the job's stage timings and its non-fatal errors.
+        """
+        job_dir = self.job_dir(job_id)
+        try:
+            frame = pd.read_csv(job_dir/"results.csv")
+        except pd.errors.EmptyDataError:
+            frame = pd.DataFrame()
+        if "model_path" in frame.columns:
+            frame["model_path"] = frame["model_path"].astype(object).where(
+                frame["model_path"].notna(), None
+            )
+        return frame, json.loads((job_dir/"summary.json").read_text())
+
+    def update(self, job_id, run, progress=None, message=None):
+        """Record progress of one run of a job
+
+        Raises JobCancelled once the job was cancelled, or was requeued and
+        handed to another run, so the caller stops working on it.
+        """
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET progress = COALESCE(?, progress), "
+                "message = COALESCE(?, message), heartbeat = ? "
+                "WHERE id = ? AND run = ? AND status = ?",
+                (progress, message, time.time(), job_id, run, RUNNING)
+            )
+        if cur.rowcount == 0:
+            raise JobCancelled(job_id)
+
+    def _finish(self, job_id, run, status, message, error=None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, error = ?, finished = ?, "
+                "progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END "
+                "WHERE id = ? AND run = ? AND status = ?",
+                (status, message, error, time.time(), status, job_id, run, RUNNING)
+            )
+
+    def requeue_stale(self):
+        """Put running jobs whose worker stopped sending heartbeats back in the queue"""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, message = 'Requeued after worker loss' "
+                "WHERE status = ? AND heartbeat < ?",
+                (QUEUED, RUNNING, time.time() - STALE_AFTER)
+            )
+            return cur.rowcount
+
+    def claim(self):
+        """Atomically start the next queued job that fits the CPU budget"""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            used = conn.execute(
+                "SELECT COALESCE(SUM(cpus), 0) FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchone()[0]
+            # Owners with fewer running jobs go first, then submission order
+            row = conn.execute(
+                "SELECT id FROM jobs AS j WHERE status = ? AND cpus <= ? ORDER BY "
+                "(SELECT COUNT(*) FROM jobs AS r WHERE r.status = ? AND r.owner IS j.owner), "
+                "submitted LIMIT 1",
+                (QUEUED, self.cpu_budget - used, RUNNING)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, started = ?, heartbeat = ?, run = ?, "
+                "message = 'Starting' WHERE id = ?",
+                (RUNNING, now, now, uuid.uuid4().hex, row["id"])
+            )
+            conn.execute("COMMIT")
+        return self.get(row["id"])
+
+    def execute(self, job):
+        """Run one claimed job to completion, recording its outcome"""
+        from backend.scheduler import SimRNAScheduler  # worker-only, like the pipeline
+
+        job_id, run = job["id"], job["run"]
+        stop_beat = threading.Event()
+        scheduler = SimRNAScheduler(max_concurrent=job["cpus"])
+
+        def beat():
+            while not stop_beat.wait(HEARTBEAT_INTERVAL):
+                try:
+                    self.update(job_id, run)
+                except JobCancelled:
+                    # Kill running SimRNA models now rather than after the next one
+                    scheduler.cancel()
+                    return
+                except Exception:
+                    return
+
+        threading.Thread(target=beat, daemon=True).start()
+        try:
+            frame, summary = run_job(
+                self.job_dir(job_id), job["params"], cpus=job["cpus"],
+                progress=lambda fraction, message: self.update(job_id, run, fraction, message),
+                scheduler=scheduler
+            )
+            self.update(job_id, run, message="Saving results")
+            job_dir = self.job_dir(job_id)
+            job_dir.mkdir(exist_ok=True, parents=True)
+            # Write then rename, so a poller never reads a half-written file
+            tmp = job_dir/f".results.{run}.csv"
+            frame.to_csv(tmp, index=False)
+            os.replace(tmp, job_dir/"results.csv")
+            tmp = job_dir/f".summary.{run}.json"
+            tmp.write_text(json.dumps(summary))
+            os.replace(tmp, job_dir/"summary.json")
+            self._finish(job_id, run, DONE, "Complete")
+        except JobCancelled:
+            pass
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(job_id, run, FAILED, f"Failed: {str(e)}", traceback.format_exc())
+        finally:
+            stop_beat.set()
+
+    def work(self, stop=None):
+        """Worker loop: claim and execute jobs until stop is set"""
+        stop = stop or self._stop
+        while not stop.is_set():
+            self.requeue_stale()
+            job = self.claim()
+            if job is None:
+                stop.wait(POLL_INTERVAL)
+                continue
+            self.execute(job)
+
+    def start(self, workers=DEFAULT_WORKERS):
+        """Start worker threads in this process; returns self"""
+        for _ in range(workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+def run_job(job_dir, params, cpus=None, progress=None, scheduler=None):
+    """Run the pipeline stages for one job
+
+    Returns (results frame, summary) where summary holds the stage timings
+    and any non-fatal errors. progress(fraction, message) is called between
+    stages and after every 3D model; it may raise JobCancelled to stop the job.
+    scheduler, if given, runs the 3D models, so the caller can cancel them.
+    """
+    from backend import pipeline  # only workers pay for the pipeline's imports
+
+    progress = progress or (lambda fraction, message: None)
+    timings = {}
+    errors = []
+    enable_3d = params.get("enable_3d", False)
+
+    progress(0.05, "Generating candidates")
+    candidates = pipeline.run_generation(params["num"], params["length"], timings,
+                                         seed=params.get("seed"))
+
+    progress(0.1, "Predicting structures")
+    def on_model(done, total, seq):
+        progress(0.1 + 0.6 * done / total, f"3D models: {done} of {total}")
+    store = pipeline.run_folding(candidates, enable_3d, cpus, timings,
+                                 on_model=on_model, on_error=errors.append,
+                                 scheduler=scheduler)
+    if len(store) == 0:
+        raise RuntimeError("No valid candidates generated")
+
+    targets = [Path(job_dir)/"targets"/f"{name}.pdb" for name in params.get("targets", [])]
+    if params.get("run_docking", True) and targets:
+        progress(0.75, "Running docking analysis" if len(targets) == 1
+                 else f"Docking against {len(targets)} targets")
+        try:
+            store = pipeline.run_docking(
+                store, targets, timings,
+                params.get("exhaustiveness", DEFAULT_EXHAUSTIVENESS), workers=cpus
+            )
+        except JobCancelled:
+            raise
+        except Exception as e:
+            errors.append(f"Docking failed: {str(e)}")
+
+    progress(0.9, "Optimizing candidates")
+    store = pipeline.run_optimization(store, timings, on_error=errors.append, workers=cpus)
+    summary = {"timings": timings, "errors": errors}
+    return pipeline.results_frame(store), summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m backend.jobs",
+        description="Serve or inspect the local pipeline job queue"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="run job workers in the foreground")
+    worker.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    worker.add_argument("--cpu-budget", type=int, default=CPU_BUDGET,
+                        help="CPUs all running jobs may use together")
+    sub.add_parser("list", help="show recent jobs")
+    cancel = sub.add_parser("cancel", help="cancel a job")
+    cancel.add_argument("job_id")
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        queue = JobQueue(cpu_budget=args.cpu_budget).start(args.workers)
+        print(f"Serving {queue.path} with {args.workers} workers", file=sys.stderr)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            queue.stop()
+    elif args.command == "list":
+        for job in JobQueue().list():
+            print(f"{job['id']}  {job['status']:<9} {job['progress']:5.0%}  "
+                  f"cpus={job['cpus']}  {job['message'] or ''}")
+    elif args.command == "cancel":
+        JobQueue().cancel(args.job_id)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
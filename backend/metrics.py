@@ -0,0 +1,157 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Configuration
+METRIC_PREFIX = "aptamer"
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(key):
+    if not key:
+        return ""
+    parts = ",".join(f'{k}="{v}"' for k, v in key)
+    return "{" + parts + "}"
+
+class Metrics:
+    """Thread-safe spans and counters for the pipeline hot paths
+
+    A span records how often a block ran and how long it took in total and
+    at worst; a counter records events such as cache hits or retries. Both
+    are keyed by name plus optional labels (e.g. tool="SimRNA").
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._spans = {}
+
+    def incr(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record one completed span of the given duration"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            count, total, worst = self._spans.get(key, (0, 0.0, 0.0))
+            self._spans[key] = (count + 1, total + seconds, max(worst, seconds))
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block; failures are counted as <name>_errors"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.incr(f"{name}_errors", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+
+    def snapshot(self):
+        """Plain-dict view of every span and counter, for JSON or display"""
+        with self._lock:
+            spans = [
+                {"name": name, "labels": dict(key), "count": count,
+                 "seconds": total, "max_seconds": worst}
+                for (name, key), (count, total, worst) in self._spans.items()
+            ]
+            counters = [
+                {"name": name, "labels": dict(key), "value": value}
+                for (name, key), value in self._counters.items()
+            ]
+        return {"timestamp": time.time(), "spans": spans, "counters": counters}
+
+    def to_prometheus(self):
+        """Render the current values in the Prometheus text exposition format"""
+        with self._lock:
+            spans = sorted(self._spans.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        if spans:
+            for suffix, kind in [("seconds_total", "counter"), ("count", "counter"),
+                                 ("seconds_max", "gauge")]:
+                lines.append(f"# TYPE {METRIC_PREFIX}_span_{suffix} {kind}")
+                for (name, key), values in spans:
+                    value = {"seconds_total": values[1], "count": values[0],
+                             "seconds_max": values[2]}[suffix]
+                    labels = _format_labels((("span", name),) + key)
+                    lines.append(f"{METRIC_PREFIX}_span_{suffix}{labels} {value}")
+        seen = set()
+        for (name, key), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write a metrics file: Prometheus text for .prom, JSON otherwise"""
+        path = Path(path)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        if path.suffix == ".prom":
+            payload = self.to_prometheus()
+        else:
+            payload = json.dumps(self.snapshot(), indent=2)
+        # Replace atomically so a scraper never reads a half-written file
+        tmp_path = path.with_suffix(f"{path.suffix}.tmp{os.getpid()}")
+        tmp_path.write_text(payload)
+        os.replace(tmp_path, path)
+        return path
+
+    def serve(self, port, host="127.0.0.1"):
+        """Expose /metrics over HTTP from a daemon thread; returns the server"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+_metrics = None
+
+def get_metrics():
+    """Process-wide metrics registry, created on first use"""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+def span(name, **labels):
+    return get_metrics().span(name, **labels)
+
+def incr(name, value=1, **labels):
+    get_metrics().incr(name, value, **labels)
+
+def run_tool(cmd, tool, **kwargs):
+    """subprocess.run wrapped in a "subprocess" span labelled with the tool"""
+    with span("subprocess", tool=tool):
+        return subprocess.run(cmd, **kwargs)
@@ -1,50 +1,137 @@
+import numpy as np
 import pandas as pd
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.exceptions import NotFittedError
-import streamlit as st
+from backend.features import FOLD_FEATURES, build_feature_matrix, build_feature_matrix_from_codes
+from backend.surrogate import get_surrogate
+from backend.similarity import DEFAULT_RADIUS, diverse_top_k
+
+def fold_extras(columns):
+    """Extra folding features present in columns ({name: array}), in FOLD_FEATURES order"""
+    return {
+        name: np.asarray(columns[name], dtype=np.float64)
+        for name in FOLD_FEATURES if name in columns
+    }
+
+def trained_surrogate(surrogate, X, affinity=None, n_jobs=None):
+    """Persisted surrogate for scoring, refit when due
+
+    Until it has docked labels, an unsaved model fit on this run's
+    placeholder affinities is used instead. n_jobs caps the CPUs any fit uses.
+    """
+    if surrogate.maybe_refit(n_jobs):
+        return surrogate
+    affinity = None if affinity is None else np.asarray(affinity, dtype=np.float64)
+    if affinity is None or np.isnan(affinity).all():
+        raise KeyError("Missing required columns: {'affinity'}")
+    valid = ~np.isnan(affinity)
+    return surrogate.transient(X[valid], affinity[valid], n_jobs)
+
+def optimize_candidates(df, on_error=print, top_k=None, radius=DEFAULT_RADIUS, target=None):
+    """Optimize aptamer candidates using machine learning
+
+    Errors are reported through on_error (e.g. st.error in the UI) so the
+    backend stays importable without Streamlit. Rows whose docked column is
+    true become training labels for the surrogate of target (the receptor
+    hash); placeholder affinities never do. With top_k, only the best top_k
+    candidates are returned, skipping any within radius substitutions of a
+    better one.
+    """
+    from sklearn.exceptions import NotFittedError  # sklearn is slow to import
 
-def optimize_candidates(df):
-    """Optimize aptamer candidates using machine learning"""
     try:
         # Check for required columns
-        required_columns = {'sequence', 'structure', 'affinity'}
+        required_columns = {'sequence', 'structure'}
         missing_cols = required_columns - set(df.columns)
         if missing_cols:
             raise KeyError(f"Missing required columns: {missing_cols}")
         
-        # Feature engineering
+        # Feature engineering: fixed-width matrix regardless of library size
         df = df.copy()
-        df['gc_content'] = df['sequence'].apply(
-            lambda s: (s.count('G') + s.count('C')) / len(s) if len(s) > 0 else 0
-        )
-        df['structure_complexity'] = df['structure'].str.count(r'[()]')
-        
-        # Create features
-        features = pd.get_dummies(df["structure"], prefix="struct")
-        X = pd.concat([df[['gc_content', 'structure_complexity']], features], axis=1)
-        y = df["affinity"]
+        structures = df["structure"].fillna("")
+        length = int(df["sequence"].str.len().max())
+        extras = fold_extras(df)
+        X, names = build_feature_matrix(df["sequence"], structures, length, extras=extras)
+        df['gc_content'] = X[:, names.index('gc_content')]
+        df['structure_complexity'] = X[:, names.index('structure_complexity')].astype(int)
         
-        # Train model
-        model = RandomForestRegressor(n_estimators=100, random_state=42)
-        model.fit(X, y)
+        # New docked affinities become training labels; the persisted model
+        # is only refit once enough of them have accumulated
+        surrogate = get_surrogate(length, extras=tuple(extras), target=target)
+        if 'affinity' in df.columns and 'docked' in df.columns:
+            docked = df["docked"].fillna(False).to_numpy(dtype=bool)
+            surrogate.add_labels(df["sequence"][docked], structures[docked],
+                                 df["affinity"][docked],
+                                 {name: values[docked] for name, values in extras.items()})
+        surrogate = trained_surrogate(surrogate, X, df.get("affinity"))
         
         # Predict scores
-        df["score"] = model.predict(X)
+        df["score"] = surrogate.predict_matrix(X)
+        df = df.sort_values("score", ascending=False)
+        if top_k:
+            df = diverse_top_k(df, top_k, radius)
         
-        return df.sort_values("score", ascending=False)
+        return df
     
     except KeyError as e:
-        st.error(f"Data format error: {str(e)}")
+        on_error(f"Data format error: {str(e)}")
         return pd.DataFrame()
     
     except ValueError as e:
-        st.error(f"Invalid data: {str(e)}")
+        on_error(f"Invalid data: {str(e)}")
         return df
     
     except NotFittedError as e:
-        st.error("Model failed to train. Check input data.")
+        on_error("Model failed to train. Check input data.")
         return df
     
     except Exception as e:
-        st.error(f"Optimization failed: {str(e)}")
+        on_error(f"Optimization failed: {str(e)}")
         return df
+
+def score_store(store, on_error=print, surrogate=None, n_jobs=None):
+    """Score every candidate of a CandidateStore in place
+
+    Same features, labels and surrogate as optimize_candidates, but read
+    straight from the store's encoded arrays, with the store's target; the
+    gc_content, structure_complexity and score columns are written by ID.
+    Returns the frozen surrogate the scores came from (also kept as
+    store.surrogate), or None (after reporting through on_error) when
+    scoring failed. Passing it back in
+    scores later stores with the same model version, though their labels
+    are still recorded. n_jobs caps the CPUs used to fit and predict
+    (default: the surrogate's own n_jobs).
+    """
+    try:
+        if store.packed_structures is None:
+            raise KeyError("Missing required columns: {'structure'}")
+        extras = fold_extras(store.columns)
+        X, names = build_feature_matrix_from_codes(store.seq_codes(), store.struct_codes(),
+                                                   extras=extras)
+        store.set("gc_content", None, X[:, names.index('gc_content')])
+        store.set("structure_complexity", None,
+                  X[:, names.index('structure_complexity')].astype(int), dtype=np.int64)
+
+        surrogate = surrogate or get_surrogate(store.length, extras=tuple(extras),
+                                               target=store.target)
+        if "affinity" in store.columns and "docked" in store.columns:
+            affinity = store.columns["affinity"]
+            labelled = store.ids[store.columns["docked"] & ~np.isnan(affinity)]
+        else:
+            labelled = []
+        if len(labelled):
+            surrogate.add_labels(store.sequences(labelled), store.structures(labelled),
+                                 affinity[labelled],
+                                 {name: values[labelled] for name, values in extras.items()})
+        surrogate = trained_surrogate(surrogate, X, store.columns.get("affinity"),
+                                      n_jobs).freeze()
+
+        store.set("score", None, surrogate.predict_matrix(X, n_jobs))
+        store.surrogate = surrogate
+        return surrogate
+
+    except KeyError as e:
+        on_error(f"Data format error: {str(e)}")
+    except ValueError as e:
+        on_error(f"Invalid data: {str(e)}")
+    except Exception as e:
+        on_error(f"Optimization failed: {str(e)}")
+    return None
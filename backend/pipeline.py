@@ -0,0 +1,546 @@
+import argparse
+import heapq
+import importlib.util
+import itertools
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from backend.cache import get_cache
+from backend.generate import CandidateGenerator
+from backend.features import FOLD_FEATURES
+from backend.structure import fold_sequences
+from backend.scheduler import SimRNAScheduler
+from backend.docking import (
+    DEFAULT_EXHAUSTIVENESS,
+    receptor_hash,
+    run_docking_analysis,
+    run_docking_matrix,
+    selectivity_scores,
+    target_names,
+)
+from backend.optimize import score_store
+from backend.store import CandidateStore
+from backend.evolve import Evolution, DEFAULT_GENERATIONS, format_generation
+from backend.metrics import get_metrics
+from backend.similarity import DEFAULT_RADIUS, diverse_top_k
+
+# Configuration
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_TOP_K = 100
+DEFAULT_PREFETCH = 2  # chunks allowed to queue up ahead of the consumer
+
+@contextmanager
+def timed(timings, stage):
+    """Accumulate wall time spent in a stage into timings[stage]
+
+    The same duration is recorded as a "stage" span in the process-wide
+    metrics, so the UI and metrics exports see every stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        get_metrics().observe("stage", elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def format_timings(timings):
+    total = sum(timings.values())
+    lines = [f"{stage:<12} {seconds:9.3f}s" for stage, seconds in timings.items()]
+    lines.append(f"{'total':<12} {total:9.3f}s")
+    return "\n".join(lines)
+
+def format_cache_stats(stats):
+    return (f"{'cache':<12} {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%}); {stats['entries']} entries, "
+            f"{stats['bytes'] / 1e6:.1f} MB")
+
+# Stages shared by the Streamlit UI, the CLI and the streaming pipeline
+
+def run_generation(num, length, timings=None, seed=None, generator=None):
+    """Draw num unique, pre-filtered candidates
+
+    Pass the same generator across calls to keep sequences unique between
+    chunks; otherwise a fresh one is seeded with seed.
+    """
+    with timed(timings, "generate"):
+        generator = generator or CandidateGenerator(length, seed=seed)
+        return generator.sequences(num)
+
+def run_folding(candidates, enable_3d=False, workers=None, timings=None,
+                on_model=None, on_error=print, fold_options=None, scheduler=None):
+    """Fold candidates into a CandidateStore with structure/mfe/weight columns
+
+    With enable_3d, SimRNA models are predicted as well (model_path and
+    simrna_energy columns) and on_model(done, total, sequence) is called as each one finishes.
+    fold_options (e.g. {"ensemble": True, "subopt": 5}) are passed to the
+    FoldingEngine, and the extra features they enable become columns too.
+    Pass scheduler (a SimRNAScheduler) to cancel the 3D models from another
+    thread; candidates it never modelled get empty structures.
+    """
+    from Bio.SeqUtils import molecular_weight
+
+    fold_options = fold_options or {}
+    with timed(timings, "fold"):
+        store = CandidateStore.from_sequences(candidates)
+        mfe = store.column("mfe")
+        if enable_3d:
+            model_paths = store.column("model_path", dtype=object)
+            energies = store.column("simrna_energy")
+            structures = [""] * len(candidates)
+            scheduler = scheduler or SimRNAScheduler(max_concurrent=workers)
+            for done, (index, result) in enumerate(scheduler.iter_results(candidates), 1):
+                structures[index] = result["secondary_structure"]
+                mfe[index] = result["mfe"]
+                model_paths[index] = result["model_path"]
+                energies[index] = result.get("energy", np.nan)
+                if on_model:
+                    on_model(done, len(candidates), candidates[index])
+            folded_ok = np.array([bool(s) for s in structures], dtype=bool)
+            # SimRNA folds MFE-only; extras need their own pass
+            folded = fold_sequences(candidates, workers=workers, **fold_options) \
+                if fold_options else []
+        else:
+            folded = fold_sequences(candidates, workers=workers, **fold_options)
+            for seq, result in zip(candidates, folded):
+                if result is None:
+                    on_error(f"Error processing {seq}: folding failed")
+            structures = [r["structure"] if r else "" for r in folded]
+            mfe[:] = [r["mfe"] if r else 0.0 for r in folded]
+            folded_ok = np.array([bool(s) for s in structures], dtype=bool)
+        for name in FOLD_FEATURES:
+            if any(r and name in r for r in folded):
+                store.set(name, None, [r.get(name, np.nan) if r else np.nan for r in folded])
+        store.set_structures(None, structures)
+        store.set("weight", None, [
+            molecular_weight(seq, seq_type="DNA") if ok else 0.0
+            for seq, ok in zip(candidates, folded_ok)
+        ])
+        return store
+
+def as_targets(target_pdb):
+    """One target PDB or a list of them, as a list"""
+    if target_pdb is None:
+        return []
+    return [target_pdb] if isinstance(target_pdb, (str, Path)) else list(target_pdb)
+
+def primary_target(target_pdb):
+    """Receptor hash of the (first) target, which keys the surrogate; None if missing"""
+    targets = as_targets(target_pdb)
+    if not targets or not Path(targets[0]).exists():
+        return None
+    return receptor_hash(targets[0])
+
+def run_docking(store, target_pdb, timings=None, exhaustiveness=DEFAULT_EXHAUSTIVENESS,
+                workers=None):
+    """Write docking affinities into store's affinity column by candidate ID
+
+    The docked column marks affinities that came from Vina rather than a
+    placeholder, and store.target is set to the receptor hash, so scoring
+    trains the right target's surrogate on real results only.
+
+    target_pdb may be a list of targets to screen the library against all
+    of them at once: every candidate x target pair is docked in one shared
+    pool, each target gets affinity_<name> and selectivity_<name> columns
+    (selectivity only from docked affinities, else NaN), and the first
+    target's affinities also fill the affinity column that scoring trains on.
+    """
+    targets = as_targets(target_pdb)
+    with timed(timings, "dock"):
+        store.target = primary_target(targets)
+        candidates = store.to_frame(columns=["sequence", "model_path", "simrna_energy"])
+        if len(targets) == 1:
+            docking_results = run_docking_analysis(
+                candidates, targets[0], exhaustiveness=exhaustiveness, workers=workers
+            )
+            # run_docking_analysis preserves input order, so rows line up with IDs
+            store.set("affinity", None, docking_results["affinity"].to_numpy())
+            store.set("docked", None, docking_results["docked"].to_numpy(), dtype=bool)
+            return store
+
+        matrix = run_docking_matrix(candidates, targets, exhaustiveness=exhaustiveness,
+                                    workers=workers)
+        names = target_names(targets)
+        affinities = matrix[[f"affinity_{name}" for name in names]].to_numpy()
+        docked = matrix[[f"docked_{name}" for name in names]].to_numpy(dtype=bool)
+        store.set("affinity", None, affinities[:, 0])
+        store.set("docked", None, docked[:, 0], dtype=bool)
+        # Placeholder affinities would make every selectivity look like a tie
+        for name, values, selectivity in zip(names, affinities.T,
+                                             selectivity_scores(affinities, docked).T):
+            store.set(f"affinity_{name}", None, values)
+            store.set(f"selectivity_{name}", None, selectivity)
+        return store
+
+def run_optimization(store, timings=None, on_error=print, workers=None):
+    """Score store in place with the surrogate model, on at most workers CPUs"""
+    with timed(timings, "optimize"):
+        score_store(store, on_error=on_error, n_jobs=workers)
+        return store
+
+def results_frame(store):
+    """Scored candidates as a DataFrame, best first; empty when scoring failed"""
+    if "score" not in store.columns:
+        return pd.DataFrame()
+    return store.to_frame(store.top(len(store)))
+
+def run_evolution(candidates, length, surrogate, generations=DEFAULT_GENERATIONS,
+                  timings=None, seed=None, workers=None, on_generation=None,
+                  on_error=print, fold_options=None):
+    """Evolve candidates against the surrogate that scored them (see score_store)
+
+    Returns the final generation as sequence/structure/mfe/score/weight
+    rows, best first; per-generation statistics go to on_generation. Without
+    a trained surrogate, evolution is skipped and None is returned after
+    reporting through on_error. fold_options must match the run's folding.
+    """
+    from Bio.SeqUtils import molecular_weight
+
+    if surrogate is None or not surrogate.is_trained:
+        on_error("Skipping evolution: no trained surrogate to score against")
+        return None
+    with timed(timings, "evolve"):
+        evolution = Evolution(length, population_size=len(candidates), seed=seed,
+                              workers=workers, surrogate=surrogate,
+                              fold_options=fold_options)
+        frame = evolution.run(candidates, generations, on_generation=on_generation)
+        frame["weight"] = [molecular_weight(seq, seq_type="DNA") for seq in frame["sequence"]]
+        return frame
+
+def run_pipeline(target_pdb, num, length, run_docking_stage=True, enable_3d=False,
+                 workers=None, timings=None, on_error=print,
+                 exhaustiveness=DEFAULT_EXHAUSTIVENESS, seed=None, fold_options=None):
+    """Run all stages in memory and return the scored CandidateStore
+
+    target_pdb may be a list of targets for a multi-target screen (see
+    run_docking); candidates are generated and folded once either way.
+    """
+    candidates = run_generation(num, length, timings, seed=seed)
+    store = run_folding(candidates, enable_3d, workers, timings, on_error=on_error,
+                        fold_options=fold_options)
+    if run_docking_stage:
+        store = run_docking(store, target_pdb, timings, exhaustiveness, workers)
+    return run_optimization(store, timings, on_error=on_error, workers=workers)
+
+def generate_chunks(num, length, chunk_size=DEFAULT_CHUNK_SIZE, timings=None, seed=None):
+    """Yield lists of fresh candidate sequences, chunk_size at a time"""
+    generator = CandidateGenerator(length, seed=seed)
+    remaining = num
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        chunk = run_generation(size, length, timings, generator=generator)
+        if not chunk:
+            return
+        yield chunk
+        remaining -= size
+
+def fold_chunks(chunks, enable_3d=False, workers=None, timings=None, fold_options=None):
+    for candidates in chunks:
+        yield run_folding(candidates, enable_3d, workers, timings, fold_options=fold_options)
+
+def dock_chunks(stores, target_pdb, timings=None, exhaustiveness=DEFAULT_EXHAUSTIVENESS,
+                workers=None):
+    for store in stores:
+        yield run_docking(store, target_pdb, timings, exhaustiveness, workers)
+
+def score_chunks(stores, timings=None, workers=None):
+    """Score each chunk and hand it on as (DataFrame, surrogate) for retention and export
+
+    The surrogate is frozen at the first chunk, so every chunk is scored by
+    the same model and TopK compares like with like. Labels from later
+    chunks are still stored and reach the model on the next run.
+    """
+    surrogate = None
+    for store in stores:
+        with timed(timings, "optimize"):
+            surrogate = score_store(store, surrogate=surrogate, n_jobs=workers) or surrogate
+        yield results_frame(store), surrogate
+
+def prefetch(iterable, depth=DEFAULT_PREFETCH):
+    """Run iterable in a background thread, at most depth items ahead
+
+    The bounded queue provides backpressure: upstream stages block once the
+    consumer falls behind instead of piling chunks up in memory.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        """Block until item is queued; False once the consumer has stopped"""
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+class TopK:
+    """Keep the k highest-scoring rows seen so far"""
+
+    def __init__(self, k=DEFAULT_TOP_K, column="score"):
+        self.k = k
+        self.column = column
+        self._heap = []
+        self._counter = itertools.count()
+
+    def update(self, frame):
+        if self.column not in frame.columns or frame.empty:
+            return
+        best = frame.nlargest(self.k, self.column)
+        for row in best.to_dict("records"):
+            entry = (row[self.column], next(self._counter), row)
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, entry)
+            elif entry[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def to_frame(self):
+        rows = [entry[2] for entry in sorted(self._heap, key=lambda e: (-e[0], e[1]))]
+        return pd.DataFrame(rows)
+
+class ChunkWriter:
+    """Append scored chunks to a Parquet or CSV file as they arrive
+
+    The first chunk fixes the columns: later chunks are reindexed to them,
+    so a column the first chunk lacked is dropped and one a later chunk
+    lacks is written as null. In Parquet, a column that is all null in the
+    first chunk (e.g. model_path without 3D models) is stored as strings.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.rows = 0
+        self.columns = None
+        self._writer = None
+        self._parquet = self.path.suffix == ".parquet"
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+
+    def write(self, frame):
+        if frame.empty:
+            return
+        if self.columns is None:
+            self.columns = list(frame.columns)
+        missing = [name for name in self.columns if name not in frame.columns]
+        # None rather than NaN, so missing values convert to null whatever the type
+        frame = frame.reindex(columns=self.columns).assign(**{
+            name: pd.Series(None, index=frame.index, dtype=object) for name in missing
+        })
+        if self._parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._writer is None:
+                schema = pa.Table.from_pandas(frame, preserve_index=False).schema
+                schema = pa.schema(
+                    [field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                     for field in schema],
+                    metadata=schema.metadata
+                )
+                self._writer = pq.ParquetWriter(self.path, schema)
+            self._writer.write_table(
+                pa.Table.from_pandas(frame, schema=self._writer.schema, preserve_index=False)
+            )
+        else:
+            frame.to_csv(self.path, mode="w" if self.rows == 0 else "a",
+                         header=self.rows == 0, index=False)
+        self.rows += len(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+def stream_pipeline(target_pdb, num, length, chunk_size=DEFAULT_CHUNK_SIZE,
+                    top_k=DEFAULT_TOP_K, out_path=None, run_docking_stage=True,
+                    enable_3d=False, workers=None, progress=None, timings=None,
+                    exhaustiveness=DEFAULT_EXHAUSTIVENESS, seed=None, fold_options=None):
+    """Run generate -> fold -> dock -> score over fixed-size chunks
+
+    Only the top_k best candidates are held in memory; every scored chunk is
+    written to out_path (.parquet or .csv) when given. progress, if given, is
+    called as progress(done, total) after each chunk. Returns the top_k
+    frame and the surrogate that scored it (None if scoring failed).
+    """
+    stores = fold_chunks(generate_chunks(num, length, chunk_size, timings, seed),
+                         enable_3d, workers, timings, fold_options)
+    stores = prefetch(stores)
+    if run_docking_stage:
+        stores = dock_chunks(stores, target_pdb, timings, exhaustiveness, workers)
+    frames = score_chunks(stores, timings, workers)
+
+    best = TopK(top_k)
+    writer = ChunkWriter(out_path) if out_path else None
+    done = 0
+    surrogate = None
+    try:
+        for frame, surrogate in frames:
+            best.update(frame)
+            if writer:
+                with timed(timings, "write"):
+                    writer.write(frame)
+            done += len(frame)
+            if progress:
+                progress(done, num)
+    finally:
+        if writer:
+            writer.close()
+    return best.to_frame(), surrogate
+
+def write_results(df, out_path):
+    out_path = Path(out_path)
+    out_path.parent.mkdir(exist_ok=True, parents=True)
+    if out_path.suffix == ".parquet":
+        df.to_parquet(out_path, index=False)
+    else:
+        df.to_csv(out_path, index=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m backend.pipeline",
+        description="Run the aptamer design pipeline without the Streamlit UI"
+    )
+    parser.add_argument("--target", nargs="+",
+                        help="target protein PDB file; give several to screen the same "
+                             "library against all of them (the first is the primary target)")
+    parser.add_argument("--length", type=int, default=20, help="aptamer length")
+    parser.add_argument("--num", type=int, default=20, help="number of candidates")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for reproducible candidate generation")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--out", default="aptamer_candidates.csv",
+                        help="output file (.csv or .parquet)")
+    parser.add_argument("--no-docking", action="store_true", help="skip docking analysis")
+    parser.add_argument("--3d", dest="enable_3d", action="store_true",
+                        help="predict 3D structures with SimRNA")
+    parser.add_argument("--ensemble", action="store_true",
+                        help="add partition-function features (ensemble energy/defect, "
+                             "MFE probability) to scoring")
+    parser.add_argument("--bpp", action="store_true",
+                        help="add base-pair probability features (pairing entropy)")
+    parser.add_argument("--subopt", type=int, default=0,
+                        help="keep this many suboptimal structures and score their energy gap")
+    parser.add_argument("--exhaustiveness", type=int, default=DEFAULT_EXHAUSTIVENESS,
+                        help="Vina search effort per ligand (lower is faster)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="stream in chunks of this size (default: stream when "
+                             f"--num exceeds {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K,
+                        help="candidates to keep in memory when streaming")
+    parser.add_argument("--generations", type=int, default=0,
+                        help="evolve the scored candidates for this many generations "
+                             "against the surrogate model")
+    parser.add_argument("--diversity-radius", type=int, default=DEFAULT_RADIUS,
+                        help="in the printed top candidates, skip any within this many "
+                             "substitutions of a better one (0 to disable)")
+    parser.add_argument("--metrics", default=None,
+                        help="write spans and counters here (.prom for Prometheus text, "
+                             "otherwise JSON)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this local port while running")
+    args = parser.parse_args(argv)
+
+    if not args.no_docking and not args.target:
+        parser.error("--target is required unless --no-docking is given")
+    # Fail before any stage runs rather than after all of them
+    if Path(args.out).suffix == ".parquet" and importlib.util.find_spec("pyarrow") is None:
+        parser.error("writing .parquet needs pyarrow (pip install pyarrow)")
+
+    metrics = get_metrics()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    fold_options = {}
+    if args.ensemble:
+        fold_options["ensemble"] = True
+    if args.bpp:
+        fold_options["bpp"] = True
+    if args.subopt:
+        fold_options["subopt"] = args.subopt
+
+    timings = {}
+    start = time.perf_counter()
+    if args.chunk_size or args.num > DEFAULT_CHUNK_SIZE:
+        def progress(done, total):
+            print(f"{done}/{total} candidates scored", file=sys.stderr)
+        top, surrogate = stream_pipeline(
+            args.target, args.num, args.length,
+            chunk_size=args.chunk_size or DEFAULT_CHUNK_SIZE, top_k=args.top_k,
+            out_path=args.out, run_docking_stage=not args.no_docking,
+            enable_3d=args.enable_3d, workers=args.workers,
+            progress=progress, timings=timings, exhaustiveness=args.exhaustiveness,
+            seed=args.seed, fold_options=fold_options
+        )
+    else:
+        store = run_pipeline(
+            args.target, args.num, args.length, run_docking_stage=not args.no_docking,
+            enable_3d=args.enable_3d, workers=args.workers, timings=timings,
+            exhaustiveness=args.exhaustiveness, seed=args.seed, fold_options=fold_options
+        )
+        top = results_frame(store)
+        surrogate = store.surrogate
+        with timed(timings, "write"):
+            write_results(top, args.out)
+
+    print(f"Wrote results to {args.out}", file=sys.stderr)
+
+    if args.generations and not top.empty:
+        def on_generation(stats):
+            print(format_generation(stats), file=sys.stderr)
+        evolved = run_evolution(
+            top["sequence"].tolist(), args.length, surrogate, args.generations, timings,
+            seed=args.seed, workers=args.workers, on_generation=on_generation,
+            on_error=lambda message: print(message, file=sys.stderr),
+            fold_options=fold_options
+        )
+        if evolved is not None:
+            top = evolved
+            evolved_out = Path(args.out).with_name(
+                f"{Path(args.out).stem}_evolved{Path(args.out).suffix}"
+            )
+            write_results(top, evolved_out)
+            print(f"Wrote evolved candidates to {evolved_out}", file=sys.stderr)
+
+    print(format_timings(timings), file=sys.stderr)
+    print(f"{'wall':<12} {time.perf_counter() - start:9.3f}s", file=sys.stderr)
+    print(format_cache_stats(get_cache().stats()), file=sys.stderr)
+    if args.metrics:
+        metrics.write(args.metrics)
+        print(f"Wrote metrics to {args.metrics}", file=sys.stderr)
+    if not top.empty:
+        print(diverse_top_k(top, 5, args.diversity_radius).to_string(index=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import asyncio
+import os
+
+from backend.metrics import span, incr
+from backend.workspace import remove_job_dir
+from backend.structure import (
+    SIMRNA_ITERATIONS,
+    cached_aptamer_structure,
+    prepare_simrna_job,
+    simrna_command,
+    extract_model,
+    fallback_result,
+    finish_simrna_job,
+)
+
+# Configuration
+DEFAULT_TIMEOUT = 1800  # seconds per SimRNA subprocess
+DEFAULT_RETRIES = 1
+
+class JobFailed(Exception):
+    pass
+
+class SimRNAScheduler:
+    """Run SimRNA 3D predictions concurrently with bounded parallelism
+
+    Each job runs the simulation as an asyncio subprocess and then reads
+    the model frame from its trajectory in-process. At most max_concurrent
+    jobs hold a SimRNA process at once, every subprocess is killed when it
+    exceeds the timeout, and a job that still fails after its retries falls
+    back to generate_dummy_pdb.
+    """
+
+    def __init__(self, max_concurrent=None, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, iterations=SIMRNA_ITERATIONS, use_cache=True):
+        self.max_concurrent = max_concurrent or os.cpu_count() or 1
+        self.timeout = timeout
+        self.retries = retries
+        self.iterations = iterations
+        self.use_cache = use_cache
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._cancelled = False
+
+    async def _run(self, cmd, cwd):
+        with span("subprocess", tool=os.path.basename(cmd[0])):
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, cwd=cwd,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), self.timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                # Never leave an orphaned SimRNA process behind
+                proc.kill()
+                await proc.wait()
+                raise
+        if proc.returncode != 0:
+            raise JobFailed(
+                f"{os.path.basename(cmd[0])} exited with {proc.returncode}: "
+                f"{stderr.decode(errors='replace')[-500:]}"
+            )
+        return stdout
+
+    async def _simulate(self, job):
+        await self._run(simrna_command(job), job["work_dir"])
+        # Trajectory parsing (and clustering) runs off the event loop
+        await asyncio.to_thread(extract_model, job)
+
+    async def predict(self, sequence, semaphore):
+        """Predict one 3D model, retrying before falling back to a dummy PDB"""
+        if self.use_cache:
+            cached = cached_aptamer_structure(sequence, self.iterations)
+            if cached:
+                return cached
+
+        async with semaphore:
+            job = prepare_simrna_job(sequence, self.iterations)
+            simulated = False
+            try:
+                for attempt in range(self.retries + 1):
+                    if attempt:
+                        incr("simrna_retries")
+                    try:
+                        await self._simulate(job)
+                        simulated = True
+                        break
+                    except asyncio.TimeoutError:
+                        incr("simrna_timeouts")
+                        print(f"SimRNA timed out for {sequence} (attempt {attempt + 1})")
+                    except Exception as e:
+                        print(f"SimRNA failed for {sequence} (attempt {attempt + 1}): {str(e)}")
+            except asyncio.CancelledError:
+                remove_job_dir(job["work_dir"])
+                raise
+        return finish_simrna_job(job, simulated, use_cache=self.use_cache)
+
+    def iter_results(self, sequences):
+        """Yield (index, result) pairs as soon as each model finishes
+
+        Closing the generator early, or calling cancel, stops outstanding
+        jobs and kills their subprocesses.
+        """
+        sequences = list(sequences)
+        loop = asyncio.new_event_loop()
+        queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        async def worker(index, sequence):
+            # Every worker enqueues exactly one item, or iter_results would
+            # wait forever on a task that died
+            result = {"secondary_structure": "", "mfe": 0.0, "model_path": None}
+            try:
+                result = await self.predict(sequence, semaphore)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. folding or scratch setup failed: preparing the job again
+                # would fail the same way
+                print(f"Scheduling failed for {sequence}: {str(e)}")
+                result = fallback_result(sequence)
+            finally:
+                queue.put_nowait((index, result))
+
+        self._loop = loop
+        self._queue = queue
+        self._tasks = [loop.create_task(worker(i, seq)) for i, seq in enumerate(sequences)]
+        try:
+            # Checked after the loop is published, so a concurrent cancel
+            # either sees it or is seen here
+            if self._cancelled:
+                return
+            for _ in sequences:
+                item = loop.run_until_complete(queue.get())
+                if item is None:  # cancelled
+                    break
+                yield item
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*self._tasks, return_exceptions=True))
+            loop.close()
+            self._loop = None
+            self._queue = None
+            self._tasks = []
+
+    def cancel(self):
+        """Cancel outstanding and future jobs; safe to call from another thread"""
+        self._cancelled = True
+        loop, queue = self._loop, self._queue
+        if loop is None or loop.is_closed():
+            return
+        try:
+            for task in list(self._tasks):
+                loop.call_soon_threadsafe(task.cancel)
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+        except RuntimeError:
+            pass  # iter_results closed the loop meanwhile
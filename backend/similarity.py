@@ -0,0 +1,248 @@
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+from backend.features import encode_sequences
+from backend.metrics import span
+
+# Configuration
+DEFAULT_RADIUS = 2  # candidates this many substitutions/edits apart are near-duplicates
+DEFAULT_METRIC = "hamming"  # or "edit" (Levenshtein, allowing shifts)
+PAIR_BATCH = 1 << 20  # candidate pairs verified at once
+MAX_BLOCK = 31  # bases per block key: 2 bits each in an int64
+MAX_TABLES = 20  # block combinations indexed for Hamming search
+
+def hamming_distance(a, b):
+    """Row-wise Hamming distance between equal-shape code arrays"""
+    return (np.asarray(a) != np.asarray(b)).sum(axis=-1)
+
+def edit_distance(a, b, cap):
+    """Row-wise Levenshtein distance between equal-length code arrays, capped
+
+    Only the diagonal band of width 2 * cap + 1 is computed, so anything
+    further apart than cap comes back as cap + 1.
+    """
+    a = np.atleast_2d(a)
+    b = np.atleast_2d(b)
+    pairs, length = a.shape
+    over = cap + 1
+    prev = np.minimum(np.arange(length + 1, dtype=np.int16), over)
+    prev = np.broadcast_to(prev, (pairs, length + 1)).copy()
+    for i in range(1, length + 1):
+        cur = np.full((pairs, length + 1), over, dtype=np.int16)
+        if i <= cap:
+            cur[:, 0] = i
+        for j in range(max(1, i - cap), min(length, i + cap) + 1):
+            substitute = prev[:, j - 1] + (a[:, i - 1] != b[:, j - 1])
+            cur[:, j] = np.minimum(np.minimum(prev[:, j] + 1, cur[:, j - 1] + 1), substitute)
+        np.minimum(cur, over, out=cur)
+        prev = cur
+    return prev[:, length].astype(np.int64)
+
+def _block_keys(codes, columns):
+    """int64 key of codes[:, columns]; rows equal on those columns get equal keys
+
+    Only the first MAX_BLOCK columns count, which keeps equal rows equal.
+    """
+    columns = np.asarray(columns)[:MAX_BLOCK]
+    weights = np.int64(4) ** np.arange(len(columns), dtype=np.int64)
+    return codes[:, columns].astype(np.int64) @ weights
+
+def _split(length, count):
+    bounds = np.linspace(0, length, count + 1).astype(int)
+    return [np.arange(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+class SimilarityIndex:
+    """Near-duplicate index over one library of equal-length sequences
+
+    Based on the pigeonhole principle. For Hamming distance, sequences are
+    split into radius + s blocks; two sequences within radius substitutions
+    agree exactly on at least s of them, so every combination of s blocks
+    is indexed, with s chosen so the combined key is wide enough to keep
+    buckets small for the library size. For edit distance, radius + 1
+    blocks are used and one of them must reappear shifted by at most radius.
+    Keys are kept sorted, so radius queries are binary searches and all
+    near-duplicate pairs come from sort-merge joins, never from comparing
+    all pairs. Every candidate pair is verified with the exact distance.
+    """
+
+    def __init__(self, seq_codes, radius=DEFAULT_RADIUS, metric=DEFAULT_METRIC):
+        if metric not in ("hamming", "edit"):
+            raise ValueError(f"Unknown distance metric: {metric}")
+        self.codes = np.asarray(seq_codes, dtype=np.uint8)
+        self.length = self.codes.shape[1]
+        self.radius = radius
+        self.metric = metric
+        # Too short to split: every sequence is a candidate for every other
+        self.exhaustive = radius >= self.length
+        self.probes = [] if self.exhaustive else self._plan()
+        self._tables = {}
+
+    def _plan(self):
+        """(query columns, indexed columns) pairs; a match on any is required"""
+        if self.metric == "edit":
+            probes = []
+            for block in _split(self.length, self.radius + 1):
+                for shift in range(-self.radius, self.radius + 1):
+                    if 0 <= block[0] + shift and block[-1] + shift < self.length:
+                        probes.append((block, block + shift))
+            return probes
+
+        # Aim for keys about two bases wider than log4(n): mostly singleton buckets
+        target = np.log(max(len(self.codes), 4)) / np.log(4) + 2
+        matches = 1
+        while (matches < self.length - self.radius
+               and matches * self.length / (self.radius + matches) < target
+               and comb(self.radius + matches + 1, matches + 1) <= MAX_TABLES):
+            matches += 1
+        blocks = _split(self.length, self.radius + matches)
+        return [
+            (columns, columns)
+            for columns in (np.concatenate(chosen) for chosen in combinations(blocks, matches))
+        ]
+
+    @classmethod
+    def from_sequences(cls, sequences, radius=DEFAULT_RADIUS, metric=DEFAULT_METRIC):
+        sequences = list(sequences)
+        lengths = {len(seq) for seq in sequences}
+        if len(lengths) > 1:
+            raise ValueError(f"Sequences must share one length, got {sorted(lengths)}")
+        return cls(encode_sequences(sequences, lengths.pop() if lengths else 0), radius, metric)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def distance(self, a, b, radius=None):
+        if self.metric == "hamming":
+            return hamming_distance(a, b)
+        return edit_distance(a, b, self.radius if radius is None else radius)
+
+    def _table(self, columns):
+        """(sorted keys, row IDs) over the given columns, built on first use"""
+        key = tuple(columns.tolist())
+        if key not in self._tables:
+            keys = _block_keys(self.codes, columns)
+            order = np.argsort(keys, kind="stable")
+            self._tables[key] = (keys[order], order)
+        return self._tables[key]
+
+    def query(self, sequence, radius=None):
+        """IDs and distances of indexed sequences within radius of sequence"""
+        radius = self.radius if radius is None else radius
+        if isinstance(sequence, str):
+            sequence = encode_sequences([sequence], self.length)[0]
+        query = np.asarray(sequence, dtype=np.uint8)[None, :]
+
+        if self.exhaustive or radius > self.radius:
+            candidates = np.arange(len(self))  # blocks only guarantee self.radius
+        else:
+            found = []
+            for columns, indexed in self.probes:
+                keys, order = self._table(indexed)
+                key = _block_keys(query, columns)[0]
+                lo, hi = np.searchsorted(keys, [key, key + 1])
+                found.append(order[lo:hi])
+            candidates = np.unique(np.concatenate(found))
+
+        distances = self.distance(self.codes[candidates],
+                                  np.repeat(query, len(candidates), axis=0), radius)
+        keep = distances <= radius
+        return candidates[keep], distances[keep]
+
+    def pairs(self):
+        """All near-duplicate pairs as (i, j, distance) arrays with i < j"""
+        found = []
+        with span("similarity_pairs"):
+            if self.exhaustive:
+                rows = np.arange(len(self))
+                found.extend(self._verify(rows, rows + 1, len(self) - rows - 1, rows))
+            for columns, indexed in self.probes:
+                keys, order = self._table(indexed)
+                if columns is indexed:
+                    # Self-join: each row pairs with the rows after it in its bucket
+                    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+                    ends = np.repeat(np.r_[starts[1:], len(keys)], np.diff(np.r_[starts, len(keys)]))
+                    lo = np.arange(1, len(keys) + 1)
+                    rows = order
+                else:
+                    query_keys = _block_keys(self.codes, columns)
+                    lo = np.searchsorted(keys, query_keys, side="left")
+                    ends = np.searchsorted(keys, query_keys, side="right")
+                    rows = np.arange(len(self))
+                counts = ends - lo
+                matched = counts > 0
+                found.extend(self._verify(rows[matched], lo[matched], counts[matched], order))
+        if not found:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, empty
+        i, j, d = (np.concatenate(parts) for parts in zip(*found))
+        _, first = np.unique(i * len(self) + j, return_index=True)
+        return i[first], j[first], d[first]
+
+    def _verify(self, rows, lo, counts, order):
+        """Pair rows[n] with order[lo[n]:lo[n] + counts[n]], in batches; keep the close pairs"""
+        ends = np.cumsum(counts)
+        first = 0
+        while first < len(counts):
+            # Largest run of rows whose matches fit in one batch
+            done = ends[first - 1] if first else 0
+            stop = max(first + 1, int(np.searchsorted(ends, done + PAIR_BATCH, side="right")))
+            batch = counts[first:stop]
+            i = np.repeat(rows[first:stop], batch)
+            offsets = np.arange(len(i)) - np.repeat(np.cumsum(batch) - batch, batch)
+            j = order[np.repeat(lo[first:stop], batch) + offsets]
+            i, j = np.minimum(i, j), np.maximum(i, j)
+            distinct = i < j
+            i, j = i[distinct], j[distinct]
+            d = self.distance(self.codes[i], self.codes[j])
+            keep = d <= self.radius
+            yield i[keep], j[keep], d[keep]
+            first = stop
+
+    def clusters(self):
+        """Connected-component label per sequence, linking near-duplicate pairs"""
+        labels = np.arange(len(self))
+        i, j, _ = self.pairs()
+        # Pointer jumping until every pair agrees on the smaller label
+        while len(i):
+            low = np.minimum(labels[i], labels[j])
+            np.minimum.at(labels, i, low)
+            np.minimum.at(labels, j, low)
+            labels = labels[labels]
+            if (labels[i] == labels[j]).all():
+                break
+        return labels
+
+def diverse_top(seq_codes, scores, k, radius=DEFAULT_RADIUS, metric=DEFAULT_METRIC):
+    """Row indices of the k best scores with no two picks within radius
+
+    Walks candidates best first; each pick removes its near-duplicates
+    (found through a SimilarityIndex) from consideration, so only k radius
+    queries are needed whatever the library size.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(-np.where(np.isnan(scores), -np.inf, scores), kind="stable")
+    order = order[~np.isnan(scores[order])]
+    if radius <= 0:
+        return order[:k]
+    index = SimilarityIndex(seq_codes, radius, metric)
+    blocked = np.zeros(len(scores), dtype=bool)
+    picks = []
+    for row in order:
+        if len(picks) == k:
+            break
+        if blocked[row]:
+            continue
+        picks.append(row)
+        neighbours, _ = index.query(index.codes[row])
+        blocked[neighbours] = True
+    return np.array(picks, dtype=np.int64)
+
+def diverse_top_k(df, k, radius=DEFAULT_RADIUS, metric=DEFAULT_METRIC, column="score"):
+    """The k best rows of df by column, skipping near-duplicates of better rows"""
+    if df.empty or column not in df.columns:
+        return df.head(0)
+    rows = diverse_top(encode_sequences(df["sequence"]), df[column].to_numpy(), k,
+                       radius, metric)
+    return df.iloc[rows]
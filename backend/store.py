@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from backend.features import (
+    SEQ_PAD,
+    encode_sequences,
+    encode_structures,
+    decode_sequences,
+    decode_structures,
+    pack_codes,
+    unpack_codes,
+)
+
+class CandidateStore:
+    """Columnar store for one library of equal-length candidates
+
+    Candidates are addressed by integer ID (their row). Sequences and
+    dot-bracket structures are kept as 2-bit packed uint8 arrays and every
+    per-candidate value (mfe, weight, affinity, score, ...) is a NumPy
+    column, so stages write their results in place by ID instead of
+    building and merging DataFrames. DataFrames are only produced by
+    to_frame, for display and export. target is the hash of the receptor
+    the affinity column was docked against, once docking has run, and
+    surrogate the frozen model the score column came from, once scored.
+    """
+
+    def __init__(self, seq_codes):
+        seq_codes = np.asarray(seq_codes, dtype=np.uint8)
+        if seq_codes.ndim != 2:
+            raise ValueError("Expected an (n, length) array of sequence codes")
+        if (seq_codes >= SEQ_PAD).any():
+            raise ValueError("Candidate sequences may only contain A, C, G and T/U")
+        self.length = seq_codes.shape[1]
+        self.ids = np.arange(len(seq_codes))
+        self.packed = pack_codes(seq_codes)
+        self.packed_structures = None
+        self.columns = {}
+        self.target = None
+        self.surrogate = None
+
+    @classmethod
+    def from_sequences(cls, sequences):
+        sequences = list(sequences)
+        lengths = {len(seq) for seq in sequences}
+        if len(lengths) > 1:
+            raise ValueError(f"Candidates must share one length, got {sorted(lengths)}")
+        return cls(encode_sequences(sequences, lengths.pop() if lengths else 0))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _rows(self, ids):
+        return self.ids if ids is None else np.asarray(ids, dtype=np.int64)
+
+    def seq_codes(self, ids=None):
+        return unpack_codes(self.packed[self._rows(ids)], self.length)
+
+    def sequences(self, ids=None):
+        return decode_sequences(self.seq_codes(ids))
+
+    def struct_codes(self, ids=None):
+        if self.packed_structures is None:
+            # Nothing folded yet: every position is padding
+            return np.full((len(self._rows(ids)), self.length), 3, dtype=np.uint8)
+        return unpack_codes(self.packed_structures[self._rows(ids)], self.length)
+
+    def structures(self, ids=None):
+        return decode_structures(self.struct_codes(ids))
+
+    def set_structures(self, ids, structures):
+        if self.packed_structures is None:
+            self.packed_structures = np.full(
+                self.packed.shape, 0xFF, dtype=np.uint8  # all padding
+            )
+        self.packed_structures[self._rows(ids)] = pack_codes(
+            encode_structures(structures, self.length)
+        )
+
+    def column(self, name, dtype=np.float64):
+        """Return the named column, creating it (NaN / empty) on first use"""
+        if name not in self.columns:
+            if np.dtype(dtype) == object:
+                self.columns[name] = np.full(len(self), None, dtype=object)
+            elif np.issubdtype(dtype, np.floating):
+                self.columns[name] = np.full(len(self), np.nan, dtype=dtype)
+            else:
+                self.columns[name] = np.zeros(len(self), dtype=dtype)
+        return self.columns[name]
+
+    def set(self, name, ids, values, dtype=np.float64):
+        """Write values for the given IDs into column name, in place"""
+        self.column(name, dtype)[self._rows(ids)] = values
+
+    def top(self, k, column="score"):
+        """IDs of the k highest values in column, best first"""
+        values = self.columns[column]
+        valid = np.flatnonzero(~np.isnan(values))
+        order = np.argsort(-values[valid], kind="stable")[:k]
+        return self.ids[valid[order]]
+
+    def to_frame(self, ids=None, columns=None):
+        """DataFrame view of the given IDs (all by default), for the UI boundary"""
+        rows = self._rows(ids)
+        data = {"sequence": self.sequences(rows)}
+        if self.packed_structures is not None:
+            data["structure"] = self.structures(rows)
+        for name, values in self.columns.items():
+            data[name] = values[rows]
+        if columns is not None:
+            data = {name: data[name] for name in columns if name in data}
+        return pd.DataFrame(data, index=pd.Index(rows, name="id"))
@@ -1,35 +1,201 @@
 import os
 import subprocess
-import hashlib
 import numpy as np
-import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-import RNA  # ViennaRNA package
+from backend.cache import get_cache, make_key, file_digest
+from backend.metrics import span, incr, run_tool
+from backend.trajectory import DEFAULT_SELECTION, Trajectory, select_frame, write_model_pdb
+from backend.workspace import create_job_dir, job_dir, remove_job_dir, store_artifact
 
 # Configuration
-TEMP_DIR = Path("temp")
-TEMP_DIR.mkdir(exist_ok=True, parents=True)
-
 # SimRNA paths
 SIMRNA_PATH = Path.home()/"Downloads"/"SimRNA_64bitIntel_Linux"
 SIMRNA_BIN = SIMRNA_PATH/"SimRNA"
-SIMRNA_TRAFL2PDBS = SIMRNA_PATH/"SimRNA_trafl2pdbs"
 SIMRNA_DATA = SIMRNA_PATH/"data"
+SIMRNA_CONFIG = SIMRNA_PATH/"configSA.dat"
+SIMRNA_ITERATIONS = 10000
+SIMRNA_MODEL_SELECTION = DEFAULT_SELECTION  # trajectory frame kept: "lowest" or "cluster"
 
-# Create data symlink in working directory
-DATA_LINK = Path("data")
-if not DATA_LINK.exists():
-    try:
-        DATA_LINK.symlink_to(SIMRNA_DATA, target_is_directory=True)
-        print("Created SimRNA data symlink")
-    except Exception as e:
-        print(f"Failed to create data symlink: {str(e)}")
+DEFAULT_SUBOPT_DELTA = 3.0  # kcal/mol above the MFE
+
+class FoldingEngine:
+    """ViennaRNA folding with optional ensemble and suboptimal features
+
+    By default only the MFE structure is computed. ensemble adds the
+    ensemble free energy, ensemble defect and MFE-structure probability;
+    bpp adds per-position pairing probabilities and their mean positional
+    entropy; subopt=k adds the k lowest suboptimal structures within
+    subopt_delta of the MFE. All of them come from the sequence's one fold
+    compound, so each sequence is folded once whatever is enabled. The
+    compound, with its energy parameters, is still built per sequence:
+    ViennaRNA cannot swap the sequence of an existing one.
+    """
+
+    def __init__(self, ensemble=False, bpp=False, subopt=0, subopt_delta=DEFAULT_SUBOPT_DELTA):
+        self.ensemble = ensemble
+        self.bpp = bpp
+        self.subopt = subopt
+        self.subopt_delta = subopt_delta
+        import RNA  # ViennaRNA package, imported on first fold
+        self.md = RNA.md()
+        if subopt:
+            self.md.uniq_ML = 1  # required by RNAsubopt
+        self.options = RNA.OPTION_MFE
+        if ensemble or bpp:
+            self.options |= RNA.OPTION_PF
+
+    @property
+    def config(self):
+        """Enabled options, as used in cache keys; empty for MFE-only folding"""
+        config = {}
+        if self.ensemble:
+            config["ensemble"] = True
+        if self.bpp:
+            config["bpp"] = True
+        if self.subopt:
+            config["subopt"] = self.subopt
+            config["subopt_delta"] = self.subopt_delta
+        return config
+
+    def fold(self, sequence):
+        """Fold one sequence; returns a dict with structure, mfe and enabled extras"""
+        import RNA
+        rna_seq = sequence.replace('T', 'U')
+        fc = RNA.fold_compound(rna_seq, self.md, self.options)
+        structure, mfe = fc.mfe()
+        result = {"structure": structure, "mfe": mfe}
+
+        if self.ensemble or self.bpp:
+            fc.exp_params_rescale(mfe)
+            _, ensemble_energy = fc.pf()
+            if self.ensemble:
+                result["ensemble_energy"] = ensemble_energy
+                result["ensemble_defect"] = fc.ensemble_defect(structure)
+                result["mfe_probability"] = fc.pr_structure(structure)
+            if self.bpp:
+                paired, entropy = pairing_profile(fc.bpp())
+                result["pair_probabilities"] = [round(float(p), 4) for p in paired]
+                result["pairing_entropy"] = float(entropy.mean()) if len(entropy) else 0.0
+
+        if self.subopt:
+            solutions = sorted(fc.subopt(int(round(self.subopt_delta * 100))),
+                               key=lambda sol: sol.energy)
+            result["suboptimals"] = [[sol.structure, sol.energy] for sol in solutions[:self.subopt]]
+            result["subopt_count"] = len(solutions)
+            result["subopt_gap"] = solutions[1].energy - mfe if len(solutions) > 1 \
+                else self.subopt_delta
+        return result
+
+def pairing_profile(bpp):
+    """Per-position pairing probability and positional entropy from fc.bpp()
+
+    bpp is ViennaRNA's 1-indexed upper-triangular probability matrix.
+    """
+    probs = np.asarray(bpp, dtype=np.float64)[1:, 1:]
+    probs = probs + probs.T
+    paired = np.clip(probs.sum(axis=1), 0.0, 1.0)
+    unpaired = 1.0 - paired
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.nansum(probs * np.log(probs), axis=1) \
+            - np.nan_to_num(unpaired * np.log(unpaired))
+    return paired, entropy
+
+# One engine per option set and process, so pool workers import ViennaRNA once
+_engines = {}
+
+def get_folding_engine(**options):
+    key = tuple(sorted(options.items()))
+    if key not in _engines:
+        _engines[key] = FoldingEngine(**options)
+    return _engines[key]
 
 def predict_secondary_structure(sequence):
     """Predict RNA secondary structure using ViennaRNA"""
-    rna_seq = sequence.replace('T', 'U')
-    structure, mfe = RNA.fold(rna_seq)
-    return structure, mfe
+    result = get_folding_engine().fold(sequence)
+    return result["structure"], result["mfe"]
+
+# Below this many sequences a process pool costs more than it saves
+MIN_PARALLEL_BATCH = 64
+
+def _fold_chunk(chunk, options=None):
+    """Fold a chunk of sequences, isolating failures per sequence"""
+    engine = get_folding_engine(**(options or {}))
+    results = []
+    for seq in chunk:
+        try:
+            results.append(engine.fold(seq))
+        except Exception as e:
+            print(f"Folding failed for {seq}: {str(e)}")
+            results.append(None)
+    return results
+
+def _fold_key(sequence, config=None):
+    import RNA
+    return make_key(sequence, "RNAfold", RNA.__version__, **(config or {}))
+
+def _fold_sequences(sequences, workers, chunksize, options):
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(sequences) < MIN_PARALLEL_BATCH:
+        return _fold_chunk(sequences, options)
+
+    # A few chunks per worker keeps the pool balanced without paying
+    # pickling overhead for every single sequence
+    if chunksize is None:
+        chunksize = max(1, -(-len(sequences) // (workers * 4)))
+    chunks = [sequences[i:i + chunksize] for i in range(0, len(sequences), chunksize)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        for chunk_results in pool.map(partial(_fold_chunk, options=options), chunks):
+            results.extend(chunk_results)
+    return results
+
+def fold_sequences(sequences, workers=None, chunksize=None, use_cache=True, **options):
+    """Fold many sequences in parallel with FoldingEngine(**options)
+
+    Returns a list of result dicts in input order (see FoldingEngine.fold);
+    sequences that fail to fold are returned as None. Results are cached
+    per sequence and option set.
+    """
+    sequences = list(sequences)
+    if not sequences:
+        return []
+    config = get_folding_engine(**options).config
+
+    if use_cache:
+        cache = get_cache()
+        keys = [_fold_key(seq, config) for seq in sequences]
+        cached = cache.get_many(set(keys))
+        misses = list(dict.fromkeys(
+            seq for seq, key in zip(sequences, keys) if key not in cached
+        ))
+        folded = dict(zip(misses, fold_sequences(
+            misses, workers=workers, chunksize=chunksize, use_cache=False, **options
+        )))
+        cache.put_many(
+            (_fold_key(seq, config), res) for seq, res in folded.items() if res is not None
+        )
+        return [cached[key] if key in cached else folded[seq]
+                for seq, key in zip(sequences, keys)]
+
+    with span("rnafold", **({"mode": "+".join(config)} if config else {})):
+        results = _fold_sequences(sequences, workers, chunksize, options)
+    incr("rnafold_sequences", len(sequences))
+    incr("rnafold_failures", sum(r is None for r in results))
+    return results
+
+def predict_secondary_structures(sequences, workers=None, chunksize=None, use_cache=True):
+    """Predict MFE secondary structures for many sequences in parallel
+
+    Returns a list of (structure, mfe) tuples in input order; sequences
+    that fail to fold are returned as None.
+    """
+    return [
+        (r["structure"], r["mfe"]) if r else None
+        for r in fold_sequences(sequences, workers, chunksize, use_cache)
+    ]
 
 def generate_dummy_pdb(sequence, output_path):
     """Generate dummy PDB structure"""
@@ -56,110 +222,158 @@ def generate_dummy_pdb(sequence, output_path):
         f.write("END\n")
     return output_path
 
-def predict_aptamer_structure(sequence):
-    """Predict 3D structure using SimRNA with proper trajectory handling"""
+def _simrna_version():
+    """Identify the installed SimRNA build by binary size and mtime"""
+    if not SIMRNA_BIN.exists():
+        return "missing"
+    stat = SIMRNA_BIN.stat()
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+def _simrna_key(sequence, iterations):
+    return make_key(
+        sequence, "SimRNA", _simrna_version(),
+        config=file_digest(SIMRNA_CONFIG),
+        iterations=iterations,
+        selection=SIMRNA_MODEL_SELECTION
+    )
+
+def cached_aptamer_structure(sequence, iterations=SIMRNA_ITERATIONS):
+    """Return the cached SimRNA result for sequence, or None"""
+    cached = get_cache().get(_simrna_key(sequence, iterations))
+    if cached and Path(cached["model_path"]).exists():
+        incr("simrna_cache", result="hit")
+        return cached
+    incr("simrna_cache", result="miss")
+    return None
+
+def prepare_simrna_job(sequence, iterations=SIMRNA_ITERATIONS):
+    """Fold sequence and write SimRNA inputs into an isolated scratch directory
+
+    SimRNA runs inside the directory (which links its data files), so
+    concurrent jobs never share output files; finish_simrna_job removes it.
+    """
     rna_sequence = sequence.replace('T', 'U').lower()
-    ss, mfe = RNA.fold(rna_sequence)
-    
-    # Create unique working directory
-    session_id = hashlib.md5(sequence.encode()).hexdigest()[:8]
-    work_dir = TEMP_DIR/f"simrna_{session_id}"
-    work_dir.mkdir(exist_ok=True, parents=True)  # Added parents=True
-    
-    # File paths
-    seq_file = work_dir/"input.seq"
-    ss_file = work_dir/"input.ss"
-    output_prefix = work_dir/"output"
-    output_pdb = TEMP_DIR/f"aptamer_{session_id}.pdb"
-    
-    try:
-        # Write input files (validate first)
-        seq_file.write_text(rna_sequence)
-        ss_file.write_text(ss)
-        print(f"Input files created: {seq_file.exists()}, {ss_file.exists()}")
-
-        # 1. Generate initial reference structure with verbose output
-        print("Running initial SimRNA (0 iterations)...")
-        result_init = subprocess.run([
-            str(SIMRNA_BIN),
-            "-s", str(seq_file),
-            "-S", str(ss_file),
-            "-c", str(SIMRNA_PATH/"configSA.dat"),
-            "-o", str(output_prefix),
-            "-n", "0"
-        ], capture_output=True, text=True, check=True)
-        
-        print(f"Initial run stdout: {result_init.stdout}")
-        print(f"Initial run stderr: {result_init.stderr}")
-        print(f"Files after initial run: {os.listdir(work_dir)}")
-
-        # Find initial PDB with multiple fallbacks
-        init_pdb = next(work_dir.glob("*-000001.pdb"), None)
-        if not init_pdb:
-            init_pdb = next(Path().glob("*-000001.pdb"), None)  # Check current dir
-        if not init_pdb:
-            raise FileNotFoundError(f"Initial PDB not found in {work_dir} or current directory")
-        
-        print(f"Found initial PDB at: {init_pdb}")
-
-        # 2. Run full simulation with output capture
-        print("Running full simulation...")
-        result_sim = subprocess.run([
-            str(SIMRNA_BIN),
-            "-s", str(seq_file),
-            "-S", str(ss_file),
-            "-c", str(SIMRNA_PATH/"configSA.dat"),
-            "-o", str(output_prefix),
-            "-n", "10000"
-        ], capture_output=True, text=True, check=True)
-        
-        print(f"Simulation stdout: {result_sim.stdout}")
-        print(f"Simulation stderr: {result_sim.stderr}")
-        print(f"Files after simulation: {os.listdir(work_dir)}")
-
-        # 3. Convert trajectory to PDB
-        traj_file = output_prefix.with_suffix(".trafl")
-        if not traj_file.exists():
-            raise FileNotFoundError(f"Trajectory file missing: {traj_file}")
-        print(f"Found trajectory file: {traj_file}")
-
-        # Convert with error capture
-        print("Converting trajectory...")
-        result_convert = subprocess.run([
-            str(SIMRNA_TRAFL2PDBS),
-            str(init_pdb),
-            str(traj_file),
-            "1"
-        ], capture_output=True, text=True, check=True)
-        
-        print(f"Conversion stdout: {result_convert.stdout}")
-        print(f"Conversion stderr: {result_convert.stderr}")
-
-        # Handle output file
-        output_frame = Path(f"{traj_file.stem}_1.pdb")
-        if not output_frame.exists():
-            # Try alternative naming patterns
-            alt_output = next(Path().glob("*_1.pdb"), None)
-            if not alt_output:
-                raise FileNotFoundError("No converted PDB found")
-            output_frame = alt_output
-        
-        print(f"Found converted PDB at: {output_frame}")
-        shutil.copy(output_frame, output_pdb)
-        print(f"Final PDB copied to: {output_pdb}")
+    ss, mfe = predict_secondary_structure(sequence)
 
-    except subprocess.CalledProcessError as e:
-        print(f"Subprocess error: {e}\nOutput: {e.output}\nStderr: {e.stderr}")
-        generate_dummy_pdb(sequence, output_pdb)
-    except Exception as e:
-        print(f"General error: {str(e)}")
-        generate_dummy_pdb(sequence, output_pdb)
+    work_dir = create_job_dir("simrna").resolve()
+    (work_dir/"data").symlink_to(SIMRNA_DATA.resolve(), target_is_directory=True)
 
-    return {
+    job = {
+        "sequence": sequence,
         "secondary_structure": ss,
         "mfe": mfe,
+        "iterations": iterations,
+        "work_dir": work_dir,
+        "seq_file": work_dir/"input.seq",
+        "ss_file": work_dir/"input.ss",
+        "output_prefix": work_dir/"output",
+        "output_pdb": work_dir/"model.pdb"
+    }
+    job["seq_file"].write_text(rna_sequence)
+    job["ss_file"].write_text(ss)
+    return job
+
+def simrna_command(job):
+    return [
+        str(SIMRNA_BIN),
+        "-s", str(job["seq_file"]),
+        "-S", str(job["ss_file"]),
+        "-c", str(SIMRNA_CONFIG),
+        "-o", str(job["output_prefix"]),
+        "-n", str(job["iterations"])
+    ]
+
+def find_trajectory(job):
+    traj_file = job["output_prefix"].with_suffix(".trafl")
+    if not traj_file.exists():
+        raise FileNotFoundError(f"Trajectory file missing: {traj_file}")
+    return traj_file
+
+def extract_model(job, selection=None):
+    """Write the selected frame of a finished run's trajectory as its model PDB
+
+    The trajectory is read in-process, so no per-frame PDBs are written;
+    the frame's SimRNA energy is kept in job["energy"].
+    """
+    with span("trajectory"):
+        with Trajectory(find_trajectory(job)) as trajectory:
+            frame = select_frame(trajectory, selection or SIMRNA_MODEL_SELECTION)
+        write_model_pdb(frame, job["sequence"], job["output_pdb"])
+    job["energy"] = frame.energy
+    return job["output_pdb"]
+
+def finish_simrna_job(job, simulated, use_cache=True):
+    """Build the result dict, falling back to a dummy model on failure
+
+    Only the final model leaves the scratch directory: it is moved into
+    the content-addressed artifact store and the directory is removed.
+    """
+    if not simulated:
+        incr("simrna_fallbacks")
+        generate_dummy_pdb(job["sequence"], job["output_pdb"])
+    try:
+        output_pdb = store_artifact(job["output_pdb"]).resolve()
+    finally:
+        remove_job_dir(job["work_dir"])
+    result = {
+        "secondary_structure": job["secondary_structure"],
+        "mfe": job["mfe"],
         "model_path": str(output_pdb)
     }
+    if simulated:
+        result["energy"] = job["energy"]
+    # Only real simulations are cached; dummy models should be retried
+    if use_cache and simulated:
+        get_cache().put(
+            _simrna_key(job["sequence"], job["iterations"]), result,
+            extra_bytes=output_pdb.stat().st_size
+        )
+    return result
+
+def fallback_result(sequence):
+    """Placeholder result for a sequence whose job could not even be prepared
+
+    Nothing is folded again: the structure is left empty and the model is a
+    dummy PDB, or None if even that cannot be written. Never raises.
+    """
+    incr("simrna_fallbacks")
+    result = {"secondary_structure": "", "mfe": 0.0, "model_path": None}
+    try:
+        with job_dir("simrna") as work_dir:
+            model = generate_dummy_pdb(sequence, work_dir/"model.pdb")
+            result["model_path"] = str(store_artifact(model).resolve())
+    except Exception as e:
+        print(f"Could not write a placeholder model for {sequence}: {str(e)}")
+    return result
+
+def predict_aptamer_structure(sequence, use_cache=True, iterations=SIMRNA_ITERATIONS):
+    """Predict 3D structure using SimRNA with proper trajectory handling"""
+    if use_cache:
+        cached = cached_aptamer_structure(sequence, iterations)
+        if cached:
+            return cached
+
+    job = prepare_simrna_job(sequence, iterations)
+    work_dir = job["work_dir"]
+    simulated = False
+
+    try:
+        # 1. Run simulation
+        run_tool(
+            simrna_command(job), "SimRNA",
+            cwd=work_dir, capture_output=True, text=True, check=True
+        )
+
+        # 2. Keep the selected trajectory frame as the model
+        extract_model(job)
+        simulated = True
+
+    except subprocess.CalledProcessError as e:
+        print(f"SimRNA step failed for {sequence} (exit {e.returncode}): {str(e.stderr)[-500:]}")
+    except Exception as e:
+        print(f"SimRNA failed for {sequence}: {str(e)}")
+
+    return finish_simrna_job(job, simulated, use_cache=use_cache)
 
 
 def predict_structure_with_rosetta(sequence):
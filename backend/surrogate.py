@@ -0,0 +1,288 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+
+from backend.features import FEATURE_VERSION, build_feature_matrix
+from backend.metrics import span
+
+# Configuration
+MODEL_DIR = Path("temp")/"models"
+LABELS_PATH = MODEL_DIR/"labels.sqlite"
+REFIT_MIN_NEW_LABELS = 100
+REFIT_GROWTH = 0.5  # also require labels to grow by this fraction before refitting
+MAX_TRAIN_LABELS = 200000
+
+class SurrogateModel:
+    """Affinity surrogate trained once on accumulated labels, reused for scoring
+
+    One model is kept per sequence length, because the per-position features
+    fix the input width, per set of extra folding features (extras, e.g.
+    ensemble_defect), which are only known for labels folded with them, and
+    per target (the receptor hash), because affinities for one receptor say
+    nothing about another. The model is saved with its feature schema, and
+    a saved model is ignored if its schema no longer matches.
+    """
+
+    def __init__(self, length, k=3, extras=(), target=None, model_dir=MODEL_DIR,
+                 labels_path=LABELS_PATH, n_jobs=-1, refit_min_new_labels=REFIT_MIN_NEW_LABELS):
+        self.length = length
+        self.k = k
+        self.extras = tuple(extras)
+        self.target = target or ""
+        self.model_dir = Path(model_dir)
+        self.labels_path = Path(labels_path)
+        self.n_jobs = n_jobs
+        self.refit_min_new_labels = refit_min_new_labels
+        self.model = None
+        self.trained_on = 0
+        self._loaded = False
+        self._frozen = False
+        self._lock = threading.Lock()
+
+    @property
+    def schema(self):
+        schema = {"feature_version": FEATURE_VERSION, "length": self.length, "k": self.k}
+        if self.extras:
+            schema["extras"] = list(self.extras)
+        if self.target:
+            schema["target"] = self.target
+        return schema
+
+    @property
+    def path(self):
+        suffix = ""
+        if self.extras:
+            suffix = "_x" + hashlib.sha256(",".join(self.extras).encode()).hexdigest()[:8]
+        if self.target:
+            suffix = f"_t{self.target}{suffix}"
+        return self.model_dir/f"surrogate_L{self.length}_k{self.k}_v{FEATURE_VERSION}{suffix}.joblib"
+
+    def _connect(self):
+        self.labels_path.parent.mkdir(exist_ok=True, parents=True)
+        conn = sqlite3.connect(self.labels_path, timeout=30)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(labels)")}
+        if columns and "target" not in columns:
+            # Label stores created before labels were kept per target: their
+            # receptor is unknown (and may be a placeholder), so set them aside
+            conn.execute("ALTER TABLE labels RENAME TO labels_untargeted")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS labels (
+                sequence TEXT NOT NULL,
+                target TEXT NOT NULL,
+                structure TEXT NOT NULL,
+                affinity REAL NOT NULL,
+                length INTEGER NOT NULL,
+                added REAL NOT NULL,
+                extras TEXT,
+                PRIMARY KEY (sequence, target)
+            )
+        """)
+        return conn
+
+    def load(self):
+        """Load the saved model on first use"""
+        if self._loaded:
+            return self.model is not None
+        self._loaded = True
+        if not self.path.exists():
+            return False
+        import joblib  # deferred with sklearn: only needed once a model exists
+        try:
+            bundle = joblib.load(self.path)
+        except Exception as e:
+            print(f"Could not load surrogate model {self.path}: {str(e)}")
+            return False
+        if bundle.get("schema") != self.schema:
+            print(f"Ignoring surrogate model with stale schema: {bundle.get('schema')}")
+            return False
+        self.model = bundle["model"]
+        self.model.n_jobs = None  # parallelism comes from _parallel, per call
+        self.trained_on = bundle["trained_on"]
+        return True
+
+    @property
+    def is_trained(self):
+        return self.load()
+
+    def add_labels(self, sequences, structures, affinities, extras=None):
+        """Record docking results against this target; re-labelled sequences are replaced
+
+        extras ({name: values}) are stored alongside and merged into any
+        already stored, so relabelling under another option set keeps the
+        features other models need.
+        """
+        now = time.time()
+        sequences = list(sequences)
+        extras = extras or {}
+        extra_rows = [
+            json.dumps({name: float(values[i]) for name, values in extras.items()
+                        if not np.isnan(values[i])}) if extras else None
+            for i in range(len(sequences))
+        ]
+        rows = [
+            (seq, self.target, struct or "", float(aff), len(seq), now, extra)
+            for seq, struct, aff, extra in zip(sequences, structures, affinities, extra_rows)
+            if seq and aff is not None and not np.isnan(aff)
+        ]
+        if not rows:
+            return 0
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "INSERT INTO labels (sequence, target, structure, affinity, length, added, "
+                "extras) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(sequence, target) DO UPDATE SET "
+                "structure = excluded.structure, affinity = excluded.affinity, "
+                "length = excluded.length, added = excluded.added, "
+                "extras = COALESCE(json_patch(labels.extras, excluded.extras), "
+                "excluded.extras, labels.extras)", rows
+            )
+            conn.commit()
+        return len(rows)
+
+    def _usable(self):
+        """WHERE clause and parameters for the labels this model can train on
+
+        Only labels folded with every extra feature qualify, so label_count
+        and fit always agree and labels from other option sets never
+        trigger a refit.
+        """
+        clause = "WHERE length = ? AND target = ?"
+        params = [self.length, self.target]
+        for name in self.extras:
+            clause += " AND json_extract(extras, ?) IS NOT NULL"
+            params.append(f"$.{name}")
+        return clause, params
+
+    def label_count(self):
+        clause, params = self._usable()
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM labels {clause}", params).fetchone()[0]
+
+    def fit(self, n_jobs=None):
+        """Train on all labels for this length and target and save the model"""
+        clause, params = self._usable()
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT sequence, structure, affinity, extras FROM labels {clause} "
+                "ORDER BY added DESC LIMIT ?",
+                (*params, MAX_TRAIN_LABELS)
+            ).fetchall()
+        if self.extras:
+            rows = [(seq, struct, aff, json.loads(values)) for seq, struct, aff, values in rows]
+        if not rows:
+            raise ValueError("No labelled candidates to train the surrogate on")
+        sequences, structures, affinities, stored = zip(*rows)
+        extras = {
+            name: [values[name] for values in stored] for name in self.extras
+        } if self.extras else None
+        X, _ = build_feature_matrix(sequences, structures, self.length, self.k, extras)
+        model = self._train(X, affinities, n_jobs)
+
+        import joblib
+
+        # Write to a temporary file first so readers never see a partial model
+        self.model_dir.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_suffix(f".tmp{os.getpid()}")
+        joblib.dump({"model": model, "schema": self.schema, "trained_on": len(rows)}, tmp_path)
+        os.replace(tmp_path, self.path)
+
+        self.model = model
+        self.trained_on = len(rows)
+        self._loaded = True
+        return self
+
+    def _parallel(self, n_jobs=None):
+        """joblib config for one predict call
+
+        The forest itself keeps n_jobs=None, so concurrent callers sharing
+        this model each run with their own CPU quota instead of mutating it.
+        """
+        import joblib
+        return joblib.parallel_config(n_jobs=self.n_jobs if n_jobs is None else n_jobs)
+
+    def _train(self, X, affinities, n_jobs=None):
+        from sklearn.ensemble import RandomForestRegressor
+
+        # Forest fitting picks its own thread pool and ignores parallel_config
+        model = RandomForestRegressor(n_estimators=100, random_state=42,
+                                      n_jobs=self.n_jobs if n_jobs is None else n_jobs)
+        with span("surrogate_fit"):
+            model.fit(X, np.asarray(affinities))
+        model.n_jobs = None  # shared from here on; see _parallel
+        return model
+
+    def transient(self, X, affinities, n_jobs=None):
+        """Unsaved model fit on the given rows only, for runs without docked labels
+
+        Placeholder affinities (simulated when Vina is unavailable) can still
+        rank the run they came from, but never reach the label store or the
+        saved model.
+        """
+        scratch = SurrogateModel(self.length, self.k, self.extras, self.target,
+                                 self.model_dir, self.labels_path, self.n_jobs)
+        scratch.model = self._train(X, affinities, n_jobs)
+        scratch.trained_on = len(X)
+        scratch._loaded = True
+        return scratch
+
+    def freeze(self):
+        """Copy that keeps scoring with the current model however often this one is refit"""
+        if self._frozen:
+            return self
+        with self._lock:
+            frozen = copy.copy(self)
+        frozen._lock = threading.Lock()
+        frozen._frozen = True
+        return frozen
+
+    def maybe_refit(self, n_jobs=None):
+        """Refit only when untrained or enough new labels have arrived; never once frozen"""
+        if self._frozen:
+            return self.is_trained
+        with self._lock:
+            count = self.label_count()
+            if not self.is_trained:
+                if count:
+                    self.fit(n_jobs)
+                return self.model is not None
+            # Geometric refit schedule keeps total training cost linear when
+            # labels stream in chunk by chunk
+            needed = max(self.refit_min_new_labels, int(self.trained_on * REFIT_GROWTH))
+            if count - self.trained_on >= needed:
+                self.fit(n_jobs)
+            return True
+
+    def predict(self, sequences, structures, extras=None, n_jobs=None):
+        """Score candidates in one batched call"""
+        X, _ = build_feature_matrix(sequences, structures, self.length, self.k, extras)
+        return self.predict_matrix(X, n_jobs)
+
+    def predict_matrix(self, X, n_jobs=None):
+        """Score a feature matrix already built with this model's schema
+
+        n_jobs caps the CPUs used for this call (default: the model's n_jobs).
+        """
+        if not self.is_trained:
+            raise ValueError("Surrogate model has not been trained")
+        with span("surrogate_predict"), self._parallel(n_jobs):
+            return self.model.predict(X)
+
+_models = {}
+
+def get_surrogate(length, k=3, extras=(), target=None):
+    """Process-wide surrogate for a sequence length and target, loaded on first use
+
+    target is the receptor hash (see backend.docking.receptor_hash) the
+    affinity labels were docked against.
+    """
+    key = (length, k, tuple(extras), target or "")
+    if key not in _models:
+        _models[key] = SurrogateModel(length, k, extras, target)
+    return _models[key]
@@ -0,0 +1,189 @@
+import mmap
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+# Configuration
+DEFAULT_SELECTION = "lowest"  # or "cluster"
+CLUSTER_FRACTION = 0.01  # lowest-energy share of frames that is clustered
+MIN_CLUSTER_FRAMES = 10
+MAX_CLUSTER_FRAMES = 500  # pairwise RMSD is quadratic in this
+CLUSTER_RMSD_PER_RESIDUE = 0.1  # Angstrom; the usual SimRNA_clust cutoff scale
+
+# SimRNA coarse-grained beads per nucleotide, in the order SimRNA writes them
+PURINE_ATOMS = ("P", "C4'", "N9", "C2", "C6")
+PYRIMIDINE_ATOMS = ("P", "C4'", "N1", "C2", "C4")
+BEADS_PER_RESIDUE = 5
+
+class Frame(NamedTuple):
+    """One trajectory snapshot; coords is an (atoms, 3) array"""
+    number: int  # SimRNA write number, 1-based
+    replica: int
+    energy: float  # including restraints, as SimRNA reports it
+    raw_energy: float  # without restraints
+    temperature: float
+    coords: np.ndarray
+
+class Trajectory:
+    """Lazy reader for SimRNA .trafl trajectories
+
+    A .trafl file holds one header line (write number, replica, energy with
+    and without restraints, temperature) and one coordinate line per frame.
+    The file is memory-mapped; opening it only scans the headers, and a
+    frame's coordinates are parsed when that frame is requested, so picking
+    the lowest-energy frame of a long run never parses the others.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file: nothing to map
+            self._data = b""
+        self._headers, self._offsets = self._index()
+
+    def _index(self):
+        data = self._data
+        size = len(data)
+        headers = []
+        offsets = []
+        pos = 0
+        while pos < size:
+            end = data.find(b"\n", pos)
+            end = size if end < 0 else end
+            fields = data[pos:end].split()
+            pos = end + 1
+            if not fields:
+                continue
+            if len(fields) < 5 or pos >= size:
+                break  # truncated tail of a run that was killed mid-write
+            end = data.find(b"\n", pos)
+            end = size if end < 0 else end
+            headers.append([float(value) for value in fields[:5]])
+            offsets.append((pos, end))
+            pos = end + 1
+        return np.array(headers, dtype=np.float64).reshape(-1, 5), offsets
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def energies(self):
+        """Energy (with restraints) of every frame, without parsing coordinates"""
+        return self._headers[:, 2]
+
+    def coords(self, index):
+        start, end = self._offsets[index]
+        values = np.fromstring(self._data[start:end], dtype=np.float64, sep=" ")
+        if len(values) % 3:
+            raise ValueError(f"Frame {index} of {self.path} has a truncated coordinate line")
+        return values.reshape(-1, 3)
+
+    def frame(self, index):
+        number, replica, energy, raw_energy, temperature = self._headers[index]
+        return Frame(int(number), int(replica), float(energy), float(raw_energy),
+                     float(temperature), self.coords(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.frame(index)
+
+    def lowest_energy(self):
+        """Frame with the lowest energy"""
+        if not len(self):
+            raise ValueError(f"No frames in {self.path}")
+        return self.frame(int(np.argmin(self.energies)))
+
+    def cluster(self, fraction=CLUSTER_FRACTION, threshold=None):
+        """Cluster the lowest-energy frames by RMSD, largest cluster first
+
+        Like SimRNA_clust, only the lowest fraction of frames by energy is
+        considered. Clusters are formed greedily around the frame with the
+        most neighbours within threshold Angstrom (0.1 per residue by
+        default). Returns dicts with the representative frame index, its
+        energy, the cluster size and the member frame indices.
+        """
+        if not len(self):
+            raise ValueError(f"No frames in {self.path}")
+        count = int(np.clip(round(len(self) * fraction), MIN_CLUSTER_FRAMES, MAX_CLUSTER_FRAMES))
+        candidates = np.argsort(self.energies, kind="stable")[:count]
+        coords = np.stack([self.coords(i) for i in candidates])
+        if threshold is None:
+            threshold = CLUSTER_RMSD_PER_RESIDUE * coords.shape[1] / BEADS_PER_RESIDUE
+
+        neighbours = pairwise_rmsd(coords) <= threshold
+        unassigned = np.ones(len(candidates), dtype=bool)
+        clusters = []
+        while unassigned.any():
+            counts = (neighbours & unassigned).sum(axis=1) * unassigned
+            centre = int(np.argmax(counts))
+            members = np.flatnonzero(neighbours[centre] & unassigned)
+            unassigned[members] = False
+            index = int(candidates[centre])
+            clusters.append({
+                "representative": index,
+                "energy": float(self.energies[index]),
+                "size": len(members),
+                "members": candidates[members].tolist()
+            })
+        return clusters
+
+def pairwise_rmsd(coords):
+    """RMSD after optimal superposition between every pair of (atoms, 3) frames
+
+    Uses the singular values of the per-pair covariance (Kabsch), batched
+    over all pairs, so no rotation matrices are formed.
+    """
+    centred = coords - coords.mean(axis=1, keepdims=True)
+    atoms = centred.shape[1]
+    norms = (centred ** 2).sum(axis=(1, 2))
+    covariance = np.einsum("pax,qay->pqxy", centred, centred)
+    singular = np.linalg.svd(covariance, compute_uv=False)
+    singular[..., 2] *= np.sign(np.linalg.det(covariance))  # no reflections
+    squared = (norms[:, None] + norms[None, :] - 2 * singular.sum(axis=-1)) / atoms
+    return np.sqrt(np.clip(squared, 0.0, None))
+
+def select_frame(trajectory, selection=DEFAULT_SELECTION):
+    """The model frame to keep: "lowest" energy, or the best of the largest "cluster" """
+    if selection == "lowest":
+        return trajectory.lowest_energy()
+    if selection == "cluster":
+        return trajectory.frame(trajectory.cluster()[0]["representative"])
+    raise ValueError(f"Unknown frame selection: {selection}")
+
+def write_model_pdb(frame, rna_sequence, output_path):
+    """Write a frame as a SimRNA coarse-grained PDB for rna_sequence"""
+    rna_sequence = rna_sequence.upper().replace("T", "U")
+    if len(frame.coords) != BEADS_PER_RESIDUE * len(rna_sequence):
+        raise ValueError(
+            f"Frame has {len(frame.coords)} beads, expected "
+            f"{BEADS_PER_RESIDUE * len(rna_sequence)} for {len(rna_sequence)} residues"
+        )
+    lines = [f"REMARK    E = {frame.energy:.6f}"]
+    serial = 0
+    for i, base in enumerate(rna_sequence, start=1):
+        atoms = PURINE_ATOMS if base in "AG" else PYRIMIDINE_ATOMS
+        for name in atoms:
+            x, y, z = frame.coords[serial]
+            serial += 1
+            lines.append(
+                f"ATOM  {serial:5d}  {name:<4s}  {base} A{i:4d}    "
+                f"{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00"
+            )
+    lines.append("TER   ")
+    lines.append("END   ")
+    Path(output_path).write_text("\n".join(lines) + "\n")
+    return output_path
@@ -0,0 +1,189 @@
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from backend.metrics import incr
+
+# Configuration
+TEMP_DIR = Path("temp")
+ARTIFACT_DIR = TEMP_DIR/"artifacts"
+SCRATCH_DIRS = [Path("/dev/shm")/"aptamer-designer", TEMP_DIR/"scratch"]  # tmpfs first
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600  # seconds
+SCRATCH_MAX_AGE = 24 * 3600  # job dirs older than this were left by a crashed run
+CLEAN_EVERY = 200  # artifacts stored between cleaning passes
+
+# Per-job files earlier versions left directly in temp/
+LEGACY_PATTERNS = ["simrna_*", "aptamer_*.pdb", "aptamer_*.pdbqt", "*.fasta", "*.ss"]
+
+_scratch_root = None
+_stored = 0
+_lock = threading.Lock()
+
+def scratch_root():
+    """First usable scratch location, preferring tmpfs"""
+    global _scratch_root
+    if _scratch_root is None:
+        for candidate in SCRATCH_DIRS:
+            try:
+                candidate.mkdir(exist_ok=True, parents=True)
+            except OSError:
+                continue
+            if os.access(candidate, os.W_OK):
+                _scratch_root = candidate
+                break
+        else:
+            _scratch_root = Path(tempfile.mkdtemp(prefix="aptamer-designer-"))
+    return _scratch_root
+
+def create_job_dir(prefix="job"):
+    """Create an isolated scratch directory; the caller removes it"""
+    return Path(tempfile.mkdtemp(prefix=f"{prefix}-", dir=scratch_root()))
+
+def remove_job_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+@contextmanager
+def job_dir(prefix="job"):
+    """Scratch directory for one job, removed afterwards whatever happens"""
+    path = create_job_dir(prefix)
+    try:
+        yield path
+    finally:
+        remove_job_dir(path)
+
+def artifact_path(digest, suffix):
+    """Sharded location of an artifact: artifacts/ab/cd/abcd....suffix"""
+    return ARTIFACT_DIR/digest[:2]/digest[2:4]/f"{digest}{suffix}"
+
+def store_artifact(path, suffix=None):
+    """Move a final artifact into the content-addressed store and return its path
+
+    Identical content is stored once; storing it again only refreshes its
+    age so the cleaner keeps it.
+    """
+    path = Path(path)
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+    dest = artifact_path(digest, path.suffix if suffix is None else suffix)
+    if dest.exists():
+        os.utime(dest)
+        path.unlink(missing_ok=True)
+    else:
+        dest.parent.mkdir(exist_ok=True, parents=True)
+        # Scratch may be on another filesystem (tmpfs), so copy then rename
+        tmp = dest.with_name(f".{dest.name}.tmp{os.getpid()}-{threading.get_ident()}")
+        shutil.move(str(path), tmp)
+        os.replace(tmp, dest)
+    incr("artifacts_stored")
+    _maybe_clean()
+    return dest
+
+def _maybe_clean():
+    global _stored
+    with _lock:
+        _stored += 1
+        due = _stored >= CLEAN_EVERY
+        if due:
+            _stored = 0
+    if due:
+        clean()
+
+def _remove(path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+def _size(path):
+    if path.is_dir() and not path.is_symlink():
+        # os.walk does not descend into symlinks such as a job's SimRNA data link
+        return sum(
+            os.lstat(os.path.join(root, name)).st_size
+            for root, _, files in os.walk(path) for name in files
+        )
+    return path.lstat().st_size
+
+def _age(path, now):
+    try:
+        return now - path.lstat().st_mtime
+    except OSError:
+        return 0  # already gone
+
+def clean(max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, now=None):
+    """Bound the workspace by age and size
+
+    Removes artifacts older than max_age, then the least recently used ones
+    until the store fits in max_bytes; also clears abandoned scratch dirs and
+    per-job leftovers from earlier versions in temp/. Returns
+    {"removed": n, "freed": bytes}.
+    """
+    now = now or time.time()
+    removed = 0
+    freed = 0
+
+    # Legacy per-job outputs and scratch dirs of crashed runs
+    stale = []
+    for pattern in LEGACY_PATTERNS:
+        stale.extend(p for p in TEMP_DIR.glob(pattern) if _age(p, now) > max_age)
+    stale.extend(p for p in scratch_root().iterdir() if _age(p, now) > SCRATCH_MAX_AGE)
+    for path in stale:
+        try:
+            size = _size(path)
+        except OSError:
+            size = 0
+        _remove(path)
+        removed += 1
+        freed += size
+
+    # Content-addressed artifacts: age first, then LRU down to max_bytes
+    artifacts = []
+    for path in ARTIFACT_DIR.glob("*/*/*"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        artifacts.append((stat.st_mtime, stat.st_size, path))
+    artifacts.sort()
+    total = sum(size for _, size, _ in artifacts)
+    for mtime, size, path in artifacts:
+        if now - mtime <= max_age and (not max_bytes or total <= max_bytes):
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+        freed += size
+
+    incr("workspace_removed", removed)
+    return {"removed": removed, "freed": freed}
+
+def usage():
+    """Entry count and bytes held by the artifact store"""
+    files = [p for p in ARTIFACT_DIR.glob("*/*/*") if p.is_file()]
+    return {"artifacts": len(files), "bytes": sum(p.stat().st_size for p in files)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m backend.workspace",
+        description="Garbage-collect the temp/ workspace"
+    )
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES,
+                        help="largest artifact store size to keep")
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE / 86400,
+                        help="remove artifacts and leftovers older than this many days")
+    args = parser.parse_args(argv)
+
+    result = clean(args.max_bytes, args.max_age * 86400)
+    print(f"Removed {result['removed']} entries, freed {result['freed'] / 1e6:.1f} MB")
+    stats = usage()
+    print(f"Artifact store: {stats['artifacts']} files, {stats['bytes'] / 1e6:.1f} MB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
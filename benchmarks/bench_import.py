@@ -0,0 +1,96 @@
+"""Cold-import budget check for the backend modules
+
+Run from the repository root:
+
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --scale 2  # slower machine
+
+Each module is imported in a fresh interpreter inside an empty working
+directory. The check fails (exit status 1) when an import takes longer than
+its budget, loads a heavy dependency that should only load on first use, or
+creates files in the working directory.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Best-of-N wall time for "import <module>", interpreter startup excluded
+IMPORT_BUDGETS = {
+    "backend.metrics": 0.1,
+    "backend.workspace": 0.1,
+    "backend.generate": 0.25,
+    "backend.structure": 0.25,
+    "backend.surrogate": 0.25,
+    "backend.jobs": 0.6,
+    "backend.pipeline": 0.6,
+}
+# Loaded on first use only: sklearn/joblib by the surrogate, RNA by folding,
+# Bio by the weight column, plotly and py3Dmol by the UI
+DEFERRED_MODULES = ["sklearn", "joblib", "RNA", "Bio", "plotly", "py3Dmol"]
+DEFAULT_REPEAT = 3
+
+PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "deferred": [m for m in {deferred!r} if m in sys.modules],
+    "files": sorted(os.listdir(".")),
+}}))
+"""
+
+def measure(module, repeat=DEFAULT_REPEAT):
+    """Import module in fresh interpreters; returns the fastest run's report"""
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT), PYTHONDONTWRITEBYTECODE="1")
+    runs = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="bench-import-") as work_dir:
+            proc = subprocess.run(
+                [sys.executable, "-c", PROBE.format(module=module, deferred=DEFERRED_MODULES)],
+                cwd=work_dir, env=env, capture_output=True, text=True, check=True
+            )
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return min(runs, key=lambda run: run["seconds"])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_import",
+        description="Check cold-import time and import-time side effects"
+    )
+    parser.add_argument("--modules", nargs="+", default=list(IMPORT_BUDGETS))
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply every budget, e.g. for slower machines")
+    parser.add_argument("--out", help="write the measurements as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    failures = 0
+    for module in args.modules:
+        report = measure(module, args.repeat)
+        budget = IMPORT_BUDGETS.get(module, max(IMPORT_BUDGETS.values())) * args.scale
+        problems = []
+        if report["seconds"] > budget:
+            problems.append(f"over budget ({budget:.3f}s)")
+        if report["deferred"]:
+            problems.append(f"loads {', '.join(report['deferred'])}")
+        if report["files"]:
+            problems.append(f"creates {', '.join(report['files'])}")
+        failures += bool(problems)
+        results[module] = {**report, "budget": budget, "problems": problems}
+        print(f"{module:<20} {report['seconds']:7.3f}s  {'; '.join(problems) or 'ok'}")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""Per-stage throughput benchmarks for the aptamer design pipeline
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --out bench.json
+    python -m benchmarks.bench_pipeline --baseline bench.json
+
+Every (stage, size) pair runs in a fresh child process with its own scratch
+working directory, so caches start cold and peak RSS is measured per stage.
+SimRNA, Meeko, Open Babel and AutoDock Vina are replaced with stubs, so the
+suite runs offline on a CPU-only machine. The docking stage still goes
+through receptor loading, ligand conversion and the docking pool, but the
+stub Vina does no search, so it measures that overhead, not docking itself.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+TARGET_PDB = REPO_ROOT/"1PPE.pdb"
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+DEFAULT_STAGES = ["generate", "fold", "simrna", "docking", "optimize"]
+DEFAULT_BATCH = 1000
+MAX_SIMRNA = 100  # every stub SimRNA call is still a process launch
+MAX_DOCKING = 1000  # every stub ligand conversion is still a process launch
+DEFAULT_TOLERANCE = 0.2
+
+STUB_FRAMES = 50  # trajectory frames written per stub SimRNA run
+
+STUB_SIMRNA = """#!{python}
+import random, sys
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+seq = open(args["-s"]).read().strip()
+with open(args["-o"] + ".trafl", "w") as f:
+    for i in range(1, {frames} + 1):
+        coords = " ".join("%.3f" % random.uniform(-20, 20) for _ in range(15 * len(seq)))
+        f.write("%d 1 %.6f %.6f 1.35\\n%s\\n" % (i, -i, -i - 10, coords))
+"""
+
+STUB_MEEKO = """#!{python}
+import sys
+out = sys.argv[sys.argv.index("-o") + 1]
+open(out + ".pdbqt", "w").write("REMARK benchmark stub receptor\\n")
+"""
+
+STUB_OBABEL = """#!{python}
+import sys
+pdb = sys.argv[sys.argv.index("-ipdb") + 1]
+sys.stdout.write("".join(line for line in open(pdb) if line.startswith("ATOM")))
+"""
+
+# Importable as "vina" ahead of any real install; no search, deterministic energies
+STUB_VINA = """
+class Vina:
+    def __init__(self, sf_name="vina", cpu=0, verbosity=1):
+        self.atoms = 0
+
+    def set_receptor(self, pdbqt):
+        open(pdbqt).close()
+
+    def compute_vina_maps(self, center, box_size):
+        pass
+
+    def set_ligand_from_file(self, pdbqt):
+        self.atoms = sum(line.startswith("ATOM") for line in open(pdbqt))
+
+    def dock(self, exhaustiveness=8, n_poses=20, max_evals=0):
+        pass
+
+    def energies(self, n_poses=20):
+        return [[-5.0 - 0.05 * self.atoms]]
+"""
+
+def install_stubs(stub_dir):
+    """Write stub SimRNA/Meeko/Open Babel/Vina and point the backend at them"""
+    stub_dir = Path(stub_dir)
+    bin_dir = stub_dir/"bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    (stub_dir/"data").mkdir(exist_ok=True)
+    (stub_dir/"configSA.dat").write_text("NUMBER_OF_ITERATIONS 1\n")
+    simrna = stub_dir/"SimRNA"
+    simrna.write_text(STUB_SIMRNA.format(python=sys.executable, frames=STUB_FRAMES))
+    simrna.chmod(0o755)
+    meeko = bin_dir/"mk_prepare_receptor.py"
+    meeko.write_text(STUB_MEEKO.format(python=sys.executable))
+    meeko.chmod(0o755)
+    obabel = bin_dir/"obabel"
+    obabel.write_text(STUB_OBABEL.format(python=sys.executable))
+    obabel.chmod(0o755)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    vina_dir = stub_dir/"python"/"vina"
+    vina_dir.mkdir(parents=True, exist_ok=True)
+    (vina_dir/"__init__.py").write_text(STUB_VINA)
+    sys.path.insert(0, str(stub_dir/"python"))  # docking workers are forked and inherit it
+
+    import backend.structure as structure
+    structure.SIMRNA_PATH = stub_dir
+    structure.SIMRNA_BIN = stub_dir/"SimRNA"
+    structure.SIMRNA_DATA = stub_dir/"data"
+    structure.SIMRNA_CONFIG = stub_dir/"configSA.dat"
+
+def _library(size, length, seed):
+    from backend.generate import generate_initial_candidates
+    return generate_initial_candidates(size, length, seed=seed)
+
+def _folded_frame(sequences):
+    import pandas as pd
+    from backend.structure import predict_secondary_structures
+    folded = predict_secondary_structures(sequences, use_cache=False)
+    return pd.DataFrame({
+        "sequence": sequences,
+        "structure": [r[0] if r else "" for r in folded],
+        "mfe": [r[1] if r else 0.0 for r in folded]
+    })
+
+def setup_stage(stage, size, length, seed, batch_size=DEFAULT_BATCH):
+    """Build the untimed input for a stage; returns (items, run_batch, batch_size)"""
+    if stage == "generate":
+        from backend.generate import CandidateGenerator
+        generator = CandidateGenerator(length, seed=seed)
+        return list(range(size)), lambda batch: generator.batch(len(batch)), batch_size
+
+    if stage == "fold":
+        from backend.structure import predict_secondary_structures
+        return _library(size, length, seed), \
+            lambda batch: predict_secondary_structures(batch, use_cache=False), batch_size
+
+    if stage == "simrna":
+        from backend.structure import predict_aptamer_structure
+        return _library(size, length, seed), \
+            lambda batch: [predict_aptamer_structure(seq, use_cache=False) for seq in batch], 1
+
+    if stage == "docking":
+        from backend.docking import run_docking_analysis, prepare_receptor
+        from backend.structure import generate_dummy_pdb
+        prepare_receptor(TARGET_PDB)  # one-off cost, amortised across runs
+        frame = _folded_frame(_library(size, length, seed))
+        # Stand-ins for simulated models: only rows with an energy are docked
+        Path("models").mkdir()
+        frame["model_path"] = [
+            str(generate_dummy_pdb(seq, Path("models")/f"{i}.pdb").resolve())
+            for i, seq in enumerate(frame["sequence"])
+        ]
+        frame["simrna_energy"] = -1.0
+        return frame, lambda batch: run_docking_analysis(batch, TARGET_PDB), batch_size
+
+    if stage == "optimize":
+        from backend.docking import simulated_affinity
+        from backend.optimize import optimize_candidates
+        frame = _folded_frame(_library(size, length, seed))
+        frame["affinity"] = [simulated_affinity(seq) for seq in frame["sequence"]]
+        frame["docked"] = True  # stands in for real docking results
+        return frame, optimize_candidates, batch_size
+
+    raise ValueError(f"Unknown stage: {stage}")
+
+def _batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux; pool workers are counted via RUSAGE_CHILDREN
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+def run_stage(stage, size, length, seed, batch_size, stub_dir, conn):
+    """Child-process body: benchmark one stage at one library size"""
+    try:
+        # Keep backend diagnostics out of the report
+        sys.stdout = open(os.devnull, "w")
+        work_dir = tempfile.mkdtemp(prefix=f"bench-{stage}-{size}-")
+        os.chdir(work_dir)
+        install_stubs(stub_dir)
+        items, run_batch, batch_size = setup_stage(stage, size, length, seed, batch_size)
+
+        latencies = []
+        start = time.perf_counter()
+        for batch in _batches(items, batch_size):
+            t0 = time.perf_counter()
+            run_batch(batch)
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+
+        conn.send({
+            "stage": stage,
+            "size": size,
+            "batch_size": batch_size,
+            "seconds": round(elapsed, 4),
+            "seq_per_sec": round(size / elapsed, 2) if elapsed > 0 else None,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "peak_rss_mb": round(_peak_rss_mb(), 1)
+        })
+        shutil.rmtree(work_dir, ignore_errors=True)
+    except Exception as e:
+        conn.send({"stage": stage, "size": size, "error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+        # atexit handlers do not run in forked children, and this process
+        # would wait forever on the docking pool's idle workers
+        docking = sys.modules.get("backend.docking")
+        if docking:
+            docking.close_pools()
+
+def benchmark(stage, size, length, seed, batch_size, stub_dir):
+    ctx = multiprocessing.get_context("fork")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=run_stage,
+                       args=(stage, size, length, seed, batch_size, stub_dir, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"stage": stage, "size": size, "error": f"child exited with {proc.exitcode}"}
+    proc.join()
+    return result
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Print throughput against a stored baseline; returns regressed entries"""
+    reference = {
+        (r["stage"], r["size"]): r for r in baseline.get("results", []) if "error" not in r
+    }
+    regressions = []
+    print(f"\n{'stage':<10} {'size':>8} {'baseline/s':>12} {'current/s':>12} {'ratio':>7}")
+    for r in results:
+        base = reference.get((r["stage"], r["size"]))
+        if not base or "error" in r or not base.get("seq_per_sec"):
+            continue
+        ratio = r["seq_per_sec"] / base["seq_per_sec"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressions.append(r)
+        print(f"{r['stage']:<10} {r['size']:>8} {base['seq_per_sec']:>12.1f} "
+              f"{r['seq_per_sec']:>12.1f} {ratio:>7.2f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help="comma-separated stages to run")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated library sizes")
+    parser.add_argument("--length", type=int, default=20, help="aptamer length")
+    parser.add_argument("--seed", type=int, default=0, help="library seed")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH,
+                        help="sequences per timed call (latency is reported per call)")
+    parser.add_argument("--max-simrna", type=int, default=MAX_SIMRNA,
+                        help="largest library size for the SimRNA stage")
+    parser.add_argument("--max-docking", type=int, default=MAX_DOCKING,
+                        help="largest library size for the docking stage")
+    parser.add_argument("--out", default=None, help="write results JSON here")
+    parser.add_argument("--baseline", default=None, help="compare against this results JSON")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed fractional throughput drop before failing")
+    args = parser.parse_args(argv)
+
+    stages = [s for s in args.stages.split(",") if s]
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    stub_dir = tempfile.mkdtemp(prefix="bench-stubs-")
+
+    results = []
+    print(f"{'stage':<10} {'size':>8} {'seq/s':>12} {'p50 ms':>10} {'p99 ms':>10} {'RSS MB':>8}")
+    for stage in stages:
+        for size in sizes:
+            if stage == "simrna" and size > args.max_simrna:
+                continue
+            if stage == "docking" and size > args.max_docking:
+                continue
+            r = benchmark(stage, size, args.length, args.seed, args.batch, stub_dir)
+            results.append(r)
+            if "error" in r:
+                print(f"{stage:<10} {size:>8} ERROR {r['error']}")
+            else:
+                print(f"{stage:<10} {size:>8} {r['seq_per_sec']:>12.1f} {r['p50_ms']:>10.2f} "
+                      f"{r['p99_ms']:>10.2f} {r['peak_rss_mb']:>8.1f}")
+    shutil.rmtree(stub_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "length": args.length,
+            "seed": args.seed,
+            "batch": args.batch
+        },
+        "results": results
+    }
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"\nWrote {args.out}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 1 if any("error" in r for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
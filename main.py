@@ -1,18 +1,19 @@
 import streamlit as st
 import sys
 import os
-import traceback
 import base64
 from pathlib import Path
-import pandas as pd
-import subprocess
-from Bio.SeqUtils import molecular_weight
-import hashlib
+import time
+import uuid
+
+@st.cache_resource(show_spinner=False)
+def encode_asset(path):
+    """Base64-encode a static asset once per process rather than on every rerun"""
+    return base64.b64encode(Path(path).read_bytes()).decode()
 
 # Set background image
 def set_background(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
+    encoded_string = encode_asset(image_path)
     st.markdown(
         f"""
         <style>
@@ -122,23 +123,85 @@ set_background("assets/background.jpg")
 PROJECT_ROOT = Path("/home/avinab/Documents/aptamer_ai")
 sys.path.append(str(PROJECT_ROOT))
 
-from backend.generate import generate_initial_candidates
-from backend.structure import predict_secondary_structure, predict_structure_with_rosetta
-from backend.docking import run_docking_analysis
-from backend.optimize import optimize_candidates
+from backend.jobs import JobQueue, QUEUED, RUNNING, DONE, FAILED
+from backend.similarity import DEFAULT_RADIUS, diverse_top_k
 
 # Configuration
 TEMP_DIR = Path("temp")
-TEMP_DIR.mkdir(exist_ok=True, parents=True)
-os.chmod(TEMP_DIR, 0o755)
 
 def render_svg(svg_path, width=140):
-    with open(svg_path, "r") as f:
-        svg = f.read()
-    b64 = base64.b64encode(svg.encode("utf-8")).decode("utf-8")
+    b64 = encode_asset(svg_path)
     html = f'<img src="data:image/svg+xml;base64,{b64}" width="{width}"/>'
     st.markdown(html, unsafe_allow_html=True)
 
+POLL_INTERVAL = 1.0  # seconds between progress refreshes of a running job
+
+@st.cache_resource(show_spinner=False)
+def job_queue():
+    """Job queue and worker threads shared by every session of this server
+
+    Runs live outside the script thread, so they keep going when a tab is
+    closed or reloaded; identical submissions share one job.
+    """
+    return JobQueue().start()
+
+def submit_design_job(target_paths, num_candidates, seq_length, seed,
+                      run_docking, enable_3d, exhaustiveness):
+    params = {
+        "num": num_candidates,
+        "length": seq_length,
+        "seed": seed,
+        "run_docking": run_docking,
+        "enable_3d": enable_3d,
+        # Exhaustiveness only changes results when 3D models are docked
+        "exhaustiveness": exhaustiveness if run_docking and enable_3d else None
+    }
+    owner = st.session_state.setdefault("owner", uuid.uuid4().hex)
+    return job_queue().submit(params, target_paths if run_docking else None, owner=owner)
+
+def load_results(job_id):
+    """Results of a finished job, read from disk once per session"""
+    results = st.session_state.get("results")
+    if not results or results["job"] != job_id:
+        optimized, summary = job_queue().results(job_id)
+        job = job_queue().get(job_id)
+        results = {
+            "job": job_id,
+            "optimized": optimized,
+            "enable_3d": job["params"].get("enable_3d", False),
+            **summary
+        }
+        st.session_state["results"] = results
+    return results
+
+def show_job(job_id):
+    """Show a job's progress, polling until it finishes, then its results"""
+    job = job_queue().get(job_id)
+    if job is None:
+        del st.query_params["job"]
+        return
+
+    if job["status"] in (QUEUED, RUNNING):
+        label = "⏳ Waiting for a free worker..." if job["status"] == QUEUED \
+            else "🔍 Running Aptamer Design Pipeline..."
+        with st.status(label, expanded=True):
+            st.progress(job["progress"], text=job["message"] or "")
+            st.caption(f"Job `{job_id}` keeps running if you close or reload this page.")
+            if st.button("✖️ Cancel"):
+                job_queue().cancel(job_id)
+                st.rerun()
+        time.sleep(POLL_INTERVAL)
+        st.rerun()
+    elif job["status"] == DONE:
+        results = load_results(job_id)
+        for error in results["errors"]:
+            st.error(error)
+        show_results(results)
+    elif job["status"] == FAILED:
+        st.error(f"❌ {job['message']}")
+    else:
+        st.warning("Pipeline run was cancelled.")
+
 def main():
     st.markdown('<h1 style="color:#222;font-weight:900;">🧬 Aptamer AI Designer</h1>', unsafe_allow_html=True)
     st.markdown('<h3 style="color:#333;font-weight:700;">Accelerated Aptamer Discovery Platform</h3>', unsafe_allow_html=True)
@@ -151,149 +214,124 @@ def main():
         except Exception as e:
             st.warning(f"ecoSPECS logo could not be loaded: {e}")
         st.header("⚙️ Configuration")
-        uploaded_file = st.file_uploader("Upload Target Protein (PDB)", type=["pdb"],
-                                        help="Upload your target protein structure in PDB format")
+        uploaded_files = st.file_uploader("Upload Target Protein (PDB)", type=["pdb"],
+                                          accept_multiple_files=True,
+                                          help="Upload your target protein structure in PDB format; "
+                                               "upload several to screen for cross-reactivity "
+                                               "(the first is the primary target)")
         seq_length = st.slider("Aptamer Length", 15, 40, 20,
                                 help="Select desired length for generated aptamers")
         num_candidates = st.number_input("Number of Candidates", 5, 100, 20,
                                         help="Number of initial candidates to generate")
+        seed = st.number_input("Random Seed", 0, 2**31 - 1, 0,
+                               help="Same seed and settings reproduce (and reuse) a previous run")
         run_docking = st.checkbox("Enable Docking Analysis", True,
                                 help="Perform molecular docking analysis")
         enable_3d = st.checkbox("Enable 3D Structure Prediction", False,
                                 help="Generate 3D structural models")
+        exhaustiveness = st.slider("Docking Exhaustiveness", 1, 32, 8,
+                                   help="Vina search effort per 3D model; lower is faster",
+                                   disabled=not (run_docking and enable_3d))
     
     # Main interface
-    if uploaded_file and st.button("🚀 Start Design Pipeline"):
-        target_path = TEMP_DIR / uploaded_file.name
-        target_path.write_bytes(uploaded_file.getvalue())
-        
-        with st.status("🔍 Running Aptamer Design Pipeline...", expanded=True) as status:
-            # Stage 1: Candidate Generation
-            st.write("1. 🧪 Generating initial candidates...")
-            candidates = generate_initial_candidates(num_candidates, seq_length)
-            
-            # Stage 2: Structure Prediction
-            st.write("2. 🧬 Predicting structures...")
-            structures = []
-            for seq in candidates:
-                try:
-                    if enable_3d:
-                        result = predict_structure_with_rosetta(seq)
-                        structures.append({
-                            "sequence": seq,
-                            "structure": result["secondary_structure"],
-                            "mfe": result["mfe"],
-                            "weight": molecular_weight(seq, seq_type="DNA"),
-                            "model_path": result["model_path"]
-                        })
-                    else:
-                        ss, mfe = predict_secondary_structure(seq)
-                        structures.append({
-                            "sequence": seq,
-                            "structure": ss,
-                            "mfe": mfe,
-                            "weight": molecular_weight(seq, seq_type="DNA")
-                        })
-                except Exception as e:
-                    st.error(f"Error processing {seq}: {str(e)}")
-                    st.code(f"Error details:\n{traceback.format_exc()}", language='text')
-                    structures.append({
-                        "sequence": seq,
-                        "structure": "",
-                        "mfe": 0.0,
-                        "weight": 0.0,
-                        "model_path": None
-                    })
-            
-            # Create DataFrame with fallback columns
-            df = pd.DataFrame(structures) if structures else pd.DataFrame(columns=["sequence", "structure", "mfe", "weight", "model_path"])
-            
-            # Early exit if no valid candidates
-            if df.empty:
-                st.error("❌ No valid candidates generated. Please check your inputs.")
-                return
-            
-            # Stage 3: Docking Analysis
-            if run_docking:
-                st.write("3. 🤖 Running docking analysis...")
-                try:
-                    docking_results = run_docking_analysis(df, target_path)
-                    df = pd.merge(df, docking_results, on="sequence")
-                except Exception as e:
-                    st.error(f"Docking failed: {str(e)}")
-            
-            # Stage 4: Optimization
-            st.write("4. 🚄 Optimizing candidates...")
-            try:
-                optimized = optimize_candidates(df)
-            except KeyError as e:
-                st.error(f"Optimization failed due to missing data: {str(e)}")
-                optimized = df
-            
-            status.update(label="✅ Pipeline complete!", state="complete", expanded=False)
+    if uploaded_files and st.button("🚀 Start Design Pipeline"):
+        TEMP_DIR.mkdir(exist_ok=True, parents=True)
+        os.chmod(TEMP_DIR, 0o755)
+        target_paths = []
+        for uploaded_file in uploaded_files:
+            target_path = TEMP_DIR / uploaded_file.name
+            target_path.write_bytes(uploaded_file.getvalue())
+            target_paths.append(target_path)
+        # The job ID lives in the URL, so a reloaded page finds its run again
+        st.query_params["job"] = submit_design_job(
+            target_paths, num_candidates, seq_length, seed,
+            run_docking, enable_3d, exhaustiveness
+        )
+
+    job_id = st.query_params.get("job")
+    if job_id:
+        show_job(job_id)
+
+def show_results(results):
+    optimized = results["optimized"]
+
+    # Display results
+    st.subheader("🏆 Top Candidates")
+    
+    if not optimized.empty:
+        cols = st.columns([2,3,2])
+        with cols[0]:
+            st.markdown("**Top Performers**")
+            st.caption(f"Near-duplicates (within {DEFAULT_RADIUS} substitutions "
+                       "of a better candidate) are skipped")
+            st.dataframe(diverse_top_k(optimized, 5),
+                        use_container_width=True,
+                        height=400)
         
-        # Display results
-        st.subheader("🏆 Top Candidates")
+        with cols[1]:
+            st.markdown("**Energy Distribution**")
+            st.plotly_chart(plot_energy_distribution(optimized),
+                          use_container_width=True)
         
-        if not optimized.empty:
-            cols = st.columns([2,3,2])
-            with cols[0]:
-                st.markdown("**Top Performers**")
-                st.dataframe(optimized.sort_values("score", ascending=False).head(5),
-                            use_container_width=True,
-                            height=400)
-            
-            with cols[1]:
-                st.markdown("**Energy Distribution**")
-                st.plotly_chart(plot_energy_distribution(optimized),
-                              use_container_width=True)
-            
-            with cols[2]:
-                st.markdown("**Export Results**")
-                st.download_button(
-                    label="📥 Download CSV",
-                    data=optimized.to_csv(index=False),
-                    file_name="aptamer_candidates.csv",
-                    mime="text/csv"
+        with cols[2]:
+            st.markdown("**Export Results**")
+            st.download_button(
+                label="📥 Download CSV",
+                data=optimized.to_csv(index=False),
+                file_name="aptamer_candidates.csv",
+                mime="text/csv"
+            )
+            if results["enable_3d"] and 'model_path' in optimized.columns:
+                st.markdown("---")
+                st.markdown("**3D Visualization**")
+                selected_seq = st.selectbox(
+                    "Select sequence", 
+                    optimized["sequence"].tolist()
                 )
-                if enable_3d and 'model_path' in optimized.columns:
-                    st.markdown("---")
-                    st.markdown("**3D Visualization**")
-                    selected_seq = st.selectbox(
-                        "Select sequence", 
-                        optimized.sort_values("score", ascending=False)["sequence"].tolist()
-                    )
-                    model_path = optimized[optimized["sequence"] == selected_seq]["model_path"].values[0]
-                    
-                    if model_path and Path(model_path).exists():
-                        try:
-                            import py3Dmol
-                            view = py3Dmol.view(width=300, height=300)
-                            with open(model_path, 'r') as f:
-                                pdb_data = f.read()
-                            view.addModel(pdb_data, 'pdb')
-                            view.setStyle({'cartoon': {'color': 'spectrum'}})
-                            view.zoomTo()
-                            view.setBackgroundColor('0xeeeeee')
-                            st.components.v1.html(view._repr_html_(), height=350)
-                        except Exception as e:
-                            st.error(f"Visualization error: {str(e)}")
-                    else:
-                        st.warning("3D model file not found")
-        else:
-            st.warning("⚠️ No optimized candidates to display")
-        
-        # Simulation diagnostics
-        if enable_3d:
-            with st.expander("🔬 Simulation Diagnostics"):
-                for seq in candidates[:3]:
-                    session_id = hashlib.md5(seq.encode()).hexdigest()[:8]
-                    work_dir = TEMP_DIR/f"simrna_{session_id}"
-                    if work_dir.exists():
-                        st.markdown(f"**Files for `{seq[:10]}...`:**")
-                        st.code("\n".join(os.listdir(work_dir)), language='text')
-                    else:
-                        st.warning(f"No directory found for {seq[:10]}...")
+                model_path = optimized[optimized["sequence"] == selected_seq]["model_path"].values[0]
+                
+                if model_path and Path(model_path).exists():
+                    try:
+                        import py3Dmol
+                        view = py3Dmol.view(width=300, height=300)
+                        with open(model_path, 'r') as f:
+                            pdb_data = f.read()
+                        view.addModel(pdb_data, 'pdb')
+                        view.setStyle({'cartoon': {'color': 'spectrum'}})
+                        view.zoomTo()
+                        view.setBackgroundColor('0xeeeeee')
+                        st.components.v1.html(view._repr_html_(), height=350)
+                    except Exception as e:
+                        st.error(f"Visualization error: {str(e)}")
+                else:
+                    st.warning("3D model file not found")
+
+        # Multi-target screens: how strongly each candidate prefers each target
+        selectivity = [c for c in optimized.columns if c.startswith("selectivity_")]
+        if selectivity:
+            affinity = [c for c in optimized.columns if c.startswith("affinity_")]
+            st.markdown("**Cross-Reactivity Screen**")
+            st.caption("Selectivity is the best off-target affinity minus the on-target "
+                       "affinity; positive values favour that target. It is blank "
+                       "where Vina did not dock the target or any off-target")
+            st.dataframe(
+                optimized[["sequence", *affinity, *selectivity]]
+                .sort_values(selectivity[0], ascending=False).head(10),
+                use_container_width=True
+            )
+    else:
+        st.warning("⚠️ No optimized candidates to display")
+    
+    # Simulation diagnostics
+    with st.expander("🔬 Simulation Diagnostics"):
+        timings = results["timings"]
+        total = sum(timings.values()) or 1.0
+        st.markdown("**Per-stage timing**")
+        st.dataframe(
+            [{"stage": stage, "seconds": round(seconds, 3), "share": round(seconds / total, 3)}
+             for stage, seconds in sorted(timings.items(), key=lambda item: -item[1])],
+            use_container_width=True
+        )
 
 def plot_energy_distribution(df):
     import plotly.express as px